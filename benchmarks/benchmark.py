@@ -0,0 +1,332 @@
+"""Benchmark the remote_command_line integration.
+
+Run sensors, binary sensors, switches, covers and services of the integration
+against an in-process Home Assistant core, executing commands locally and over
+SSH. The SSH commands use the ssh
+stand-in of benchmarks/bin, which runs them on the local host, unless --real-ssh
+is given to target an actual sshd with --ssh-user, --ssh-host and --ssh-key.
+
+Usage: python benchmarks/benchmark.py [--entities 10 100 1000] [--json out.json]
+
+The number of entities is per platform.
+
+Home Assistant must be installed in the Python environment.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import resource
+import statistics
+import tempfile
+import threading
+import time
+
+from homeassistant import bootstrap, config_entries, core, loader
+from homeassistant.setup import async_setup_component
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_SSH_DIR = Path(__file__).resolve().parent / "bin"
+DOMAIN = "remote_command_line"
+COMMAND = "echo value"
+PLATFORMS = ("sensor", "binary_sensor", "switch", "cover")
+
+
+def current_rss():
+    """Return the resident set size of the process in MiB."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, percent):
+    """Return a percentile of a list of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, round(len(values) * percent / 100))
+    return values[index]
+
+
+class ThreadSampler:
+    """Sample the number of threads of the process."""
+
+    def __init__(self):
+        """Initialize the sampler."""
+        self.peak = threading.active_count()
+        self._task = None
+
+    async def _async_sample(self):
+        """Record the peak number of threads."""
+        while True:
+            self.peak = max(self.peak, threading.active_count())
+            await asyncio.sleep(0.005)
+
+    def start(self):
+        """Start sampling."""
+        self._task = asyncio.get_running_loop().create_task(self._async_sample())
+
+    async def async_stop(self):
+        """Stop sampling."""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def async_start_hass(config_dir):
+    """Start a minimal Home Assistant core."""
+    hass = core.HomeAssistant(config_dir)
+    hass.config.skip_pip = True
+    loader.async_setup(hass)
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await bootstrap.async_load_base_functionality(hass)
+    assert await async_setup_component(hass, "homeassistant", {})
+    return hass
+
+
+async def async_measure(calls):
+    """Run calls concurrently, returning the duration and the call latencies."""
+    latencies = []
+
+    async def async_timed(call):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(async_timed(call) for call in calls))
+    return time.perf_counter() - started, latencies
+
+
+def platform_configs(entities, ssh_options):
+    """Return the configuration of the benchmarked entities of each platform.
+
+    The commands are distinct, to measure executions rather than the cache, and
+    the entities are only updated on request.
+    """
+    # Run by the shell, ": index" only makes the commands distinct
+    devices = {
+        "switch": {
+            f"bench_{index}": {
+                "command_on": f"true {index}",
+                "command_off": f"true {index}",
+                "command_state": f"true {index}",
+                "polling": False,
+                "burst_interval": 0,
+            }
+            for index in range(entities)
+        },
+        "cover": {
+            f"bench_{index}": {
+                "command_open": f"true {index}",
+                "command_close": f"true {index}",
+                "command_stop": f"true {index}",
+                "command_state": f"echo 50; : {index}",
+                "polling": False,
+                "burst_interval": 0,
+            }
+            for index in range(entities)
+        },
+    }
+    return {
+        "sensor": [
+            {
+                "platform": DOMAIN,
+                "name": f"bench {index}",
+                "command": f"{COMMAND} {index}",
+                "polling": False,
+                **ssh_options,
+            }
+            for index in range(entities)
+        ],
+        "binary_sensor": [
+            {
+                "platform": DOMAIN,
+                "name": f"bench {index}",
+                "command": f"echo ON; : {index}",
+                "polling": False,
+                **ssh_options,
+            }
+            for index in range(entities)
+        ],
+        "switch": [{"platform": DOMAIN, "switches": devices["switch"], **ssh_options}],
+        "cover": [{"platform": DOMAIN, "covers": devices["cover"], **ssh_options}],
+    }
+
+
+def is_updated(state):
+    """Return whether a benchmarked entity got the state of its command."""
+    if state is None:
+        return False
+    if state.domain == "sensor":
+        return state.state.startswith("value")
+    if state.domain == "cover":
+        return state.attributes.get("current_position") == 50
+    return state.state == "on"
+
+
+async def async_run_scenario(config_dir, entities, ssh_options, rounds, settings):
+    """Benchmark polling entities, their actions and services for one execution mode."""
+    hass = await async_start_hass(config_dir)
+    sampler = ThreadSampler()
+    sampler.start()
+    rss_before = current_rss()
+
+    domain_config = dict(settings)
+    domain_config["bench_service"] = {"command": COMMAND, **ssh_options}
+    assert await async_setup_component(hass, DOMAIN, {DOMAIN: domain_config})
+
+    started = time.perf_counter()
+    for platform, configs in platform_configs(entities, ssh_options).items():
+        assert await async_setup_component(hass, platform, {platform: configs})
+    await hass.async_block_till_done()
+    setup_time = time.perf_counter() - started
+
+    entity_ids = {
+        platform: [f"{platform}.bench_{index}" for index in range(entities)]
+        for platform in PLATFORMS
+    }
+
+    def update_entity(entity_id):
+        return lambda: hass.services.async_call(
+            "homeassistant", "update_entity", {"entity_id": entity_id}, blocking=True
+        )
+
+    def call_action(domain, service, entity_id):
+        return lambda: hass.services.async_call(
+            domain, service, {"entity_id": entity_id}, blocking=True
+        )
+
+    def call_service():
+        return hass.services.async_call(DOMAIN, "bench_service", {}, blocking=True)
+
+    measures = {
+        **{
+            f"{platform} polls": [update_entity(entity_id) for entity_id in ids]
+            for platform, ids in entity_ids.items()
+        },
+        "switch actions": [
+            call_action("switch", "turn_on", entity_id) for entity_id in entity_ids["switch"]
+        ],
+        "cover actions": [
+            call_action("cover", "open_cover", entity_id) for entity_id in entity_ids["cover"]
+        ],
+        "services": [call_service] * entities,
+    }
+    totals = {name: (0.0, []) for name in measures}
+    for _ in range(rounds):
+        for name, calls in measures.items():
+            duration, latencies = await async_measure(calls)
+            totals[name] = (totals[name][0] + duration, totals[name][1] + latencies)
+
+    stale = [
+        entity_id
+        for ids in entity_ids.values()
+        for entity_id in ids
+        if not is_updated(hass.states.get(entity_id))
+    ]
+    assert not stale, f"Some entities did not get their state: {stale[:5]}"
+
+    await sampler.async_stop()
+    rss_after = current_rss()
+    await hass.async_stop()
+
+    def summary(duration, latencies):
+        return {
+            "commands_per_s": len(latencies) / duration if duration else None,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.fmean(latencies) * 1000,
+        }
+
+    return {
+        "setup_s": setup_time,
+        "measures": {name: summary(*total) for name, total in totals.items()},
+        "peak_threads": sampler.peak,
+        "rss_mib": rss_after,
+        "rss_growth_mib": rss_after - rss_before,
+    }
+
+
+def print_result(mode, entities, result):
+    """Print the result of a scenario."""
+    print(
+        f"{mode:<6} {entities:>5}"
+        f" | setup {result['setup_s']:7.2f}s"
+        f" | threads {result['peak_threads']:3d}"
+        f" | rss {result['rss_mib']:7.1f}MiB (+{result['rss_growth_mib']:.1f})"
+    )
+    for name, measure in result["measures"].items():
+        print(
+            f"    {name:<20}"
+            f" {measure['commands_per_s']:8.1f}/s"
+            f" p50 {measure['p50_ms']:8.1f}ms p99 {measure['p99_ms']:8.1f}ms"
+        )
+
+
+async def async_main(args):
+    """Run the benchmarks."""
+    if args.real_ssh:
+        ssh_options = {"ssh_user": args.ssh_user, "ssh_host": args.ssh_host}
+        if args.ssh_key:
+            ssh_options["ssh_key"] = args.ssh_key
+    else:
+        os.environ["PATH"] = f"{FAKE_SSH_DIR}{os.pathsep}{os.environ['PATH']}"
+        ssh_options = {"ssh_user": "bench", "ssh_host": "localhost"}
+    settings = {}
+    if args.max_concurrent:
+        settings["max_concurrent"] = args.max_concurrent
+
+    results = []
+    with tempfile.TemporaryDirectory() as config_dir:
+        if not args.real_ssh:
+            # An existing key, read by the stand-in of ssh only, so that no key
+            # pair gets generated
+            ssh_options["ssh_key"] = os.path.join(config_dir, "bench_key")
+            Path(ssh_options["ssh_key"]).touch(mode=0o600)
+        modes = {"local": {}, "ssh": ssh_options}
+        os.makedirs(os.path.join(config_dir, "custom_components"))
+        os.symlink(
+            ROOT / "custom_components" / DOMAIN,
+            os.path.join(config_dir, "custom_components", DOMAIN),
+        )
+        for mode in args.modes:
+            for entities in args.entities:
+                result = await async_run_scenario(
+                    config_dir, entities, modes[mode], args.rounds, settings
+                )
+                print_result(mode, entities, result)
+                results.append({"mode": mode, "entities": entities, **result})
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+
+def main():
+    """Parse the arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--entities", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--modes", nargs="+", choices=["local", "ssh"], default=["local", "ssh"])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--max-concurrent", type=int)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--real-ssh", action="store_true", help="use the ssh binary")
+    parser.add_argument("--ssh-user", default=os.environ.get("USER"))
+    parser.add_argument("--ssh-host", default="localhost")
+    parser.add_argument("--ssh-key")
+    asyncio.run(async_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,27 +4,99 @@ from __future__ import annotations
 import asyncio
 import logging
 import os
-import subprocess
-from homeassistant.const import CONF_COMMAND, CONF_NAME, CONF_TIMEOUT
-from homeassistant.core import HomeAssistant, ServiceCall
+import time
+from homeassistant.const import (
+    CONF_COMMAND,
+    CONF_NAME,
+    CONF_PLATFORM,
+    CONF_SCAN_INTERVAL,
+    CONF_TIMEOUT,
+    EVENT_HOMEASSISTANT_STOP,
+    Platform,
+)
+from homeassistant.core import (
+    Event,
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+    callback,
+)
 from homeassistant.helpers.typing import ConfigType
+from homeassistant.requirements import async_process_requirements
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
 from pathlib import Path
 
-from homeassistant.exceptions import TemplateError
-from homeassistant.helpers import template
+from homeassistant.exceptions import HomeAssistantError, TemplateError
+from homeassistant.helpers import discovery, template
+from homeassistant.helpers.reload import (
+    async_integration_yaml_config,
+    async_setup_reload_service,
+)
 from datetime import datetime
+from functools import partial
 
 from .const import (
+    ASYNCSSH_REQUIREMENT,
+    BACKEND_ASYNCSSH,
     BASE_SSH_SCHEMA,
+    CONF_CACHE_TTL,
     CONF_COMMAND_TIMEOUT,
+    CONF_ENTITIES,
+    CONF_GROUPS,
+    CONF_HOST_GROUP,
+    CONF_HOSTS,
+    CONF_MAX_CONCURRENT,
+    CONF_MAX_OUTPUT_BYTES,
+    CONF_MODE,
+    CONF_OUTPUT_KEEP,
+    CONF_PARALLELISM,
+    CONF_POLL_JITTER,
+    BACKEND_OPENSSH,
+    CONF_SSH_BACKEND,
+    CONF_SSH_BATCH_WINDOW,
     CONF_SSH_HOST,
+    CONF_SSH_IDLE_TIMEOUT,
     CONF_SSH_KEY,
+    CONF_SSH_MAX_SESSIONS,
+    CONF_SSH_MULTIPLEX,
     CONF_SSH_USER,
+    CONF_STATS,
+    CONF_STREAM_OUTPUT,
+    DATA_BATCHERS,
+    DATA_CACHE,
+    DATA_COORDINATORS,
+    DATA_POOL,
+    DATA_SCHEDULER,
+    DATA_SSH_KEY,
+    DATA_SSH_KEY_LOCK,
+    DATA_SSH_KEYS_CHECKED,
+    DATA_STATS,
+    DATA_STATS_LISTENER,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_MAX_CONCURRENT,
+    DEFAULT_PARALLELISM,
+    DEFAULT_SCAN_INTERVAL,
+    DEFAULT_SSH_IDLE_TIMEOUT,
+    DEFAULT_SSH_KEY,
+    DEFAULT_SSH_MAX_SESSIONS,
     DEFAULT_TIMEOUT,
     DOMAIN,
+    EVENT_OUTPUT,
+    MODE_POLL,
+    OUTPUT_TAIL,
+    PLATFORMS,
+    SERVICE_GET_STATS,
 )
+from .batch import CommandBatcher
+from .breaker import HostUnreachable
+from .cache import ResultCache
+from .coordinator import HostCoordinator
+from .pool import SshConnectionPool
+from .process import CommandResult, OutputCapture, async_exec, async_stream
+from .scheduler import PRIORITY_ACTION, PRIORITY_POLL, CommandScheduler
+from .stats import CommandStats
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -32,64 +104,189 @@ SERVICE_SCHEMA = vol.Schema(BASE_SSH_SCHEMA).extend(
     {
         vol.Required(CONF_COMMAND): cv.template,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
+        vol.Optional(CONF_STREAM_OUTPUT, default=False): cv.boolean,
+        vol.Optional(CONF_HOSTS): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional(CONF_PARALLELISM, default=DEFAULT_PARALLELISM): cv.positive_int,
+    }
+)
+
+# Data of the calls of the configured services
+SERVICE_CALL_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_COMMAND_TIMEOUT): cv.positive_int,
+        vol.Optional(CONF_STREAM_OUTPUT): cv.boolean,
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
+HOST_SCHEMA = vol.Schema(BASE_SSH_SCHEMA).extend(
+    {
+        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.time_period,
+        vol.Required(CONF_ENTITIES): vol.All(
+            cv.ensure_list,
+            [
+                vol.Schema(
+                    {vol.Required(CONF_PLATFORM): vol.In(PLATFORMS)},
+                    extra=vol.ALLOW_EXTRA,
+                )
+            ],
+        ),
     }
 )
 
+# Settings of the whole integration, every other key is a service
+DOMAIN_SETTINGS = {
+    vol.Optional(CONF_MAX_CONCURRENT, default=DEFAULT_MAX_CONCURRENT): cv.positive_int,
+    vol.Optional(CONF_POLL_JITTER, default=0): vol.All(
+        vol.Coerce(float), vol.Range(min=0)
+    ),
+    vol.Optional(CONF_STATS, default=False): cv.boolean,
+    vol.Optional(CONF_HOSTS, default={}): cv.schema_with_slug_keys(HOST_SCHEMA),
+    vol.Optional(CONF_GROUPS, default={}): cv.schema_with_slug_keys(
+        vol.All(cv.ensure_list, [cv.string])
+    ),
+}
+
+
+def _validate_service_hosts(conf):
+    """Check that the hosts of the services are configured hosts or groups."""
+    for name, service_conf in conf.items():
+        if name in DOMAIN_SETTINGS:
+            continue
+        for target in service_conf.get(CONF_HOSTS, []):
+            if target not in conf[CONF_HOSTS] and target not in conf[CONF_GROUPS]:
+                raise vol.Invalid(
+                    f"Service {name}: {target} is neither in hosts nor in groups"
+                )
+    return conf
+
+
 CONFIG_SCHEMA = vol.Schema(
-    {DOMAIN: cv.schema_with_slug_keys(SERVICE_SCHEMA)}, extra=vol.ALLOW_EXTRA
+    {
+        DOMAIN: vol.All(
+            vol.Schema({**DOMAIN_SETTINGS, cv.slug: SERVICE_SCHEMA}),
+            _validate_service_hosts,
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
 )
 
 
-def call_shell_with_returncode(command, timeout):
-    """Run a shell command with a timeout.
+def _find_ssh_key():
+    """Return the path of the existing default private key, if any."""
+    for key in (DEFAULT_SSH_KEY, os.path.join(Path.home(), ".ssh", "id_rsa")):
+        if os.path.isfile(key):
+            return key
+    return None
+
 
-    If log_return_code is set to False, it will not print an error if a non-zero
-    return code is returned.
+async def async_get_default_ssh_key(hass):
+    """Return the default private key, generating a keypair if there is none.
+
+    The key is looked up once, under a lock so that the entities set up
+    together do not generate it concurrently.
     """
-    try:
-        subprocess.check_output(
-            command, shell=True, timeout=timeout  # nosec # shell by design
-        )
-        return 0
-    except subprocess.CalledProcessError as proc_exception:
-        _LOGGER.error("Command failed: %s", command)
-        return proc_exception.returncode
-    except subprocess.TimeoutExpired:
-        _LOGGER.error("Timeout for command: %s", command)
-        return -1
-    except subprocess.SubprocessError:
-        _LOGGER.error("Error trying to exec command: %s", command)
-        return -1
-
-
-def call_shell_with_value(command, timeout):
-    """Run a shell command with a timeout and return the output."""
-    try:
-        return_value = subprocess.check_output(
-            command, shell=True, timeout=timeout  # nosec # shell by design
+    async with hass.data.setdefault(DATA_SSH_KEY_LOCK, asyncio.Lock()):
+        if DATA_SSH_KEY not in hass.data:
+            key = await hass.async_add_executor_job(_find_ssh_key)
+            if key is None:
+                _LOGGER.info("Generating an SSH keypair in %s", DEFAULT_SSH_KEY)
+                try:
+                    returncode, _ = await async_exec(
+                        f"mkdir -p {os.path.dirname(DEFAULT_SSH_KEY)}"
+                        f" && ssh-keygen -q -b 2048 -t rsa -N '' -f {DEFAULT_SSH_KEY}",
+                        30,
+                    )
+                except (asyncio.TimeoutError, OSError):
+                    returncode = -1
+                if returncode != 0:
+                    _LOGGER.error("Unable to generate an SSH keypair in %s", DEFAULT_SSH_KEY)
+                key = DEFAULT_SSH_KEY
+            hass.data[DATA_SSH_KEY] = key
+    return hass.data[DATA_SSH_KEY]
+
+
+async def async_check_ssh_key(hass, key):
+    """Warn, once per key, if a configured private key does not exist."""
+    checked = hass.data.setdefault(DATA_SSH_KEYS_CHECKED, set())
+    if key in checked:
+        return
+    checked.add(key)
+    if not await hass.async_add_executor_job(os.path.isfile, key):
+        _LOGGER.warning("SSH key %s does not exist", key)
+
+
+def get_connection(hass, config, ssh_key, ssh_host):
+    """Return the pooled SSH connection for a configuration."""
+    if DATA_POOL not in hass.data:
+        hass.data[DATA_POOL] = SshConnectionPool(hass.config.path(".ssh", "control"))
+    pool = hass.data[DATA_POOL]
+    return pool.get(
+        config.get(CONF_SSH_USER),
+        ssh_host,
+        ssh_key,
+        config.get(CONF_SSH_IDLE_TIMEOUT, DEFAULT_SSH_IDLE_TIMEOUT),
+        config.get(CONF_SSH_MULTIPLEX, True),
+        config.get(CONF_SSH_BACKEND, BACKEND_OPENSSH),
+    )
+
+
+def get_scheduler(hass) -> CommandScheduler:
+    """Return the scheduler bounding the concurrent commands."""
+    if DATA_SCHEDULER not in hass.data:
+        hass.data[DATA_SCHEDULER] = CommandScheduler(DEFAULT_MAX_CONCURRENT)
+    return hass.data[DATA_SCHEDULER]
+
+
+def get_batcher(hass, config, connection) -> CommandBatcher | None:
+    """Return the command batcher of an SSH connection, if batching is enabled."""
+    window = config.get(CONF_SSH_BATCH_WINDOW, 0)
+    if not window:
+        return None
+    batchers = hass.data.setdefault(DATA_BATCHERS, {})
+    if connection not in batchers:
+        batchers[connection] = CommandBatcher(
+            window,
+            connection,
+            get_scheduler(hass),
+            config.get(CONF_SSH_MAX_SESSIONS, DEFAULT_SSH_MAX_SESSIONS),
         )
-        return return_value.strip().decode("utf-8")
-    except subprocess.CalledProcessError:
-        _LOGGER.error("Command failed: %s", command)
-        return "Error: Command failed"
-    except subprocess.TimeoutExpired:
-        _LOGGER.error("Timeout for command: %s", command)
-        return "Error: Timeout for command"
-    except subprocess.SubprocessError:
-        _LOGGER.error("Error trying to exec command: %s", command)
-        return "Error trying to exec command"
+    return batchers[connection]
 
-    return None
+
+def get_stats(hass) -> CommandStats:
+    """Return the execution statistics."""
+    if DATA_STATS not in hass.data:
+        hass.data[DATA_STATS] = CommandStats(hass)
+    return hass.data[DATA_STATS]
+
+
+def get_cache(hass) -> ResultCache:
+    """Return the shared command result cache."""
+    return hass.data.setdefault(DATA_CACHE, ResultCache(DEFAULT_CACHE_SIZE))
 
 
 class CommandData:
     """The class for handling the data retrieval."""
 
-    def __init__(self, hass, config, command):
-        """Initialize the data object."""
+    def __init__(self, hass, config, command, action=False, name=None):
+        """Initialize the data object.
+
+        Action commands (e.g. turning a switch on) always run and are never
+        shared with other entities through the result cache. name identifies the
+        command in the execution statistics.
+        """
         self.value = None
+        # Whether the last update got a different output than the previous one
+        self.changed = True
+        # Whether the last update could not get an output
+        self.failed = False
         self.hass = hass
         self.config = config
+        self.action = action
+        self.name = name or config.get(CONF_NAME)
+        # Name of the command in the execution statistics, after its entity once added
+        self.stats_name = None
         self.command: template.Template = command
         if self.command and self.hass:
             self.command.hass = self.hass
@@ -97,107 +294,440 @@ class CommandData:
         self.ssh_user = config.get(CONF_SSH_USER)
         self.ssh_host = config.get(CONF_SSH_HOST)
         self.ssh_key = config.get(CONF_SSH_KEY)
+        self.cache_ttl = config.get(CONF_CACHE_TTL, 0)
+        # Whether the command runs even if the result cache has its output
+        self.bypass_cache = False
+        self._rendered = None
+        self._connection = None
+        self._coordinator = None
+        self._remove_from_coordinator = None
+        host_group = config.get(CONF_HOST_GROUP)
+        if host_group and not action and config.get(CONF_MODE, MODE_POLL) == MODE_POLL:
+            self._coordinator = hass.data[DATA_COORDINATORS][host_group]
+            self._remove_from_coordinator = self._coordinator.async_add(self)
+
+    @property
+    def available(self):
+        """Return whether the host of the command is not known to be unreachable."""
+        return self._connection is None or self._connection.breaker.closed
+
+    async def async_prepare(self, variables=None):
+        """Render the command and get the SSH connection to run it on.
 
-    def update(self, with_value):
-        """Get the latest data with a shell command."""
+        Return a (command, connection) tuple, connection being None for local
+        commands, or None if the command template could not be rendered or the
+        SSH backend installed.
+        """
         try:
-            command = self.command.render()
+            command = self._render_command(variables)
         except TemplateError as ex:
             _LOGGER.exception("Error rendering command template: %s", ex)
-            return None if with_value else -1
+            return None
 
         if not self.ssh_user and not self.ssh_host and not self.ssh_key:
-            ssh_command = command
+            return command, None
+        if self._connection is not None:
+            return command, self._connection
+
+        if self.ssh_key:
+            await async_check_ssh_key(self.hass, self.ssh_key)
         else:
-            if not self.ssh_key:
-                home = str(Path.home())
-                if not os.path.isfile("/config/.ssh/id_rsa") and not os.path.isfile(
-                    home + "/.ssh/id_rsa"
-                ):
-                    call_shell_with_value(
-                        "mkdir /config/.ssh && ssh-keygen -q -b 2048 -t rsa -N '' -f /config/.ssh/id_rsa",
-                        30,
-                    )
-                self.ssh_key = "/config/.ssh/id_rsa"
-            escaped_command = command.replace("'", "''")
-            command_key = ""
-            command_target = ""
-            command_user = self.ssh_user
-            if self.ssh_key:
-                command_key = f"-i {self.ssh_key}"
-            if self.ssh_host:
-                command_target = self.ssh_host
-            else:
-                command_target = "172.17.0.1"
-
-            ssh_command = f"ssh -4 -o ConnectTimeout=3 -o StrictHostKeyChecking=no {command_key} {command_user}@{command_target} '{escaped_command}'"
+            self.ssh_key = await async_get_default_ssh_key(self.hass)
+        if self.ssh_host:
+            command_target = self.ssh_host
+        else:
+            command_target = "172.17.0.1"
+        if self.config.get(CONF_SSH_BACKEND) == BACKEND_ASYNCSSH:
+            try:
+                await async_process_requirements(self.hass, DOMAIN, [ASYNCSSH_REQUIREMENT])
+            except HomeAssistantError as ex:
+                _LOGGER.error("Unable to install %s: %s", ASYNCSSH_REQUIREMENT, ex)
+                return None
 
-        _LOGGER.debug("Running command: %s", command)
-        if with_value:
-            self.value = call_shell_with_value(ssh_command, self.timeout)
+        try:
+            self._connection = get_connection(
+                self.hass, self.config, self.ssh_key, command_target
+            )
+        except ImportError as ex:
+            # Not installed when Home Assistant skips the requirements
+            _LOGGER.error("Unable to load %s: %s", ASYNCSSH_REQUIREMENT, ex)
+            return None
+        return command, self._connection
+
+    def _render_command(self, variables=None):
+        """Render the command, reusing the last rendering while its inputs are unchanged.
+
+        Only a rendering depending on entities alone is reused, until one of
+        their states changes. A rendering depending on the time, on whole
+        domains, on the set of entities, or on nothing the states tell, like
+        random values or the configuration, is never reused, nor is a rendering
+        with variables.
+        """
+        if self.command.is_static:
+            return self.command.template
+        if variables:
+            return self.command.async_render(variables, parse_result=False)
+        if self._rendered is not None:
+            command, states = self._rendered
+            if all(self.hass.states.get(entity_id) is state for entity_id, state in states):
+                return command
+
+        info = self.command.async_render_to_info()
+        command = info.result()
+        if (
+            not info.entities
+            or info.has_time
+            or info.all_states
+            or info.all_states_lifecycle
+            or info.domains
+            or info.domains_lifecycle
+        ):
+            self._rendered = None
         else:
-            self.value = call_shell_with_returncode(ssh_command, self.timeout)
+            self._rendered = (
+                command,
+                tuple(
+                    (entity_id, self.hass.states.get(entity_id))
+                    for entity_id in info.entities
+                ),
+            )
+        return command
 
+    async def async_update(self, with_value, timeout=None, stdin=None, variables=None):
+        """Get the latest data with a shell command.
+
+        Return the output of the command, or its exit code if not with_value.
+        timeout overrides the timeout of the configuration, stdin is passed to
+        the command as its input and variables to its template.
+        """
+        result = await self.async_run(timeout, stdin, variables)
+        # A non-zero exit code is a failure too when the output is expected
+        self.failed = result.returncode is None or (with_value and result.returncode != 0)
+        if result.command is None:
+            return None if with_value else -1
+
+        if not with_value:
+            value = -1 if result.returncode is None else result.returncode
+        elif result.timed_out:
+            value = "Error: Timeout for command"
+        elif result.returncode is None:
+            value = "Error trying to exec command"
+        elif result.returncode != 0:
+            value = "Error: Command failed"
+        else:
+            value = result.output
+        self.set_value(value)
         return self.value
 
+    async def async_run(
+        self, timeout=None, stdin=None, variables=None, with_stderr=False, output_callback=None
+    ):
+        """Run the command and return its CommandResult.
+
+        The error output is only collected with_stderr, and output_callback is
+        passed each chunk of output as it is read, the command then running on
+        its own. The command of the result is None if it could not be prepared.
+        """
+        prepared = await self.async_prepare(variables)
+        if prepared is None:
+            return CommandResult(error="Error preparing command")
+        command, connection = prepared
+
+        _LOGGER.debug("Running command: %s", command)
+        stderr = None
+        if with_stderr:
+            stderr = OutputCapture(self.config.get(CONF_MAX_OUTPUT_BYTES), OUTPUT_TAIL)
+        exec_func = self._exec_func(command, connection, stdin, stderr, output_callback)
+        result = CommandResult(command)
+        started = time.monotonic()
+        try:
+            result.returncode, result.stdout = await exec_func(
+                command, timeout or self.timeout, stdin
+            )
+        except asyncio.TimeoutError:
+            _LOGGER.error("Timeout for command: %s", command)
+            result.timed_out = True
+            result.error = "Timeout for command"
+        except HostUnreachable as ex:
+            # Logged once by the circuit of the host
+            _LOGGER.debug("%s, not running: %s", ex, command)
+            result.error = str(ex)
+        except OSError as ex:
+            _LOGGER.error("Error trying to exec command: %s", command)
+            result.error = str(ex) or "Error trying to exec command"
+        result.duration = time.monotonic() - started
+        if stderr is not None:
+            result.stderr = stderr.getvalue()
+        if result.returncode not in (None, 0):
+            _LOGGER.error("Command failed: %s", command)
+        return result
+
+    async def async_stream(self, command, connection, line_callback):
+        """Run a prepared command, passing each output line to line_callback.
+
+        Return the exit code of the command once it exits. On a host, the
+        command holds one of its ssh_max_sessions while it runs.
+        """
+        if not connection:
+            return await async_stream(command, line_callback)
+        return await get_scheduler(self.hass).async_run_session(
+            connection.host,
+            self.config.get(CONF_SSH_MAX_SESSIONS),
+            connection.async_stream,
+            command,
+            line_callback,
+        )
+
+    def _exec_func(self, command, connection, stdin, stderr=None, output_callback=None):
+        """Return the exec function running command, through the cache and scheduler."""
+        priority = PRIORITY_ACTION if self.action else PRIORITY_POLL
+        host = connection.host if connection else None
+        recorder = get_stats(self.hass).recorder(host, self.stats_name or self.name)
+        batcher = None
+        max_output = self.config.get(CONF_MAX_OUTPUT_BYTES)
+        # Runs collecting their outputs as they come are never shared
+        shared = stdin is None and stderr is None and output_callback is None
+        if connection and shared and not max_output:
+            batcher = get_batcher(self.hass, self.config, connection)
+        if self._coordinator is not None and shared:
+            # Polled by the coordinator of the host, along with its other commands
+            exec_func = partial(self._coordinator.async_exec, self)
+        elif batcher:
+            exec_func = recorder.wrap(partial(batcher.async_exec, priority=priority))
+        else:
+            base_exec = connection.async_exec if connection else async_exec
+            if max_output or output_callback:
+                capture = OutputCapture(
+                    max_output, self.config.get(CONF_OUTPUT_KEEP), output_callback
+                )
+                base_exec = partial(base_exec, capture=capture)
+            if stderr is not None:
+                base_exec = partial(base_exec, stderr=stderr)
+            exec_func = partial(
+                get_scheduler(self.hass).async_run,
+                host,
+                self.config.get(CONF_SSH_MAX_SESSIONS) if connection else None,
+                priority,
+                recorder.wrap(base_exec),
+            )
+        if not self.action and shared and self._coordinator is None and not self.bypass_cache:
+            exec_func = partial(
+                get_cache(self.hass).async_exec,
+                (command, connection, max_output, self.config.get(CONF_OUTPUT_KEEP)),
+                self.cache_ttl,
+                exec_func,
+            )
+        return exec_func
+
+    @callback
+    def async_release(self):
+        """Stop polling the command with the other commands of its host."""
+        if self._remove_from_coordinator:
+            self._remove_from_coordinator()
+            self._remove_from_coordinator = None
+
+    def set_value(self, value):
+        """Store the output of the command, noting whether it changed."""
+        self.changed = value != self.value
+        self.value = value
+
+
+class OutputEvents:
+    """Fire an event for each line of the output of a service call."""
+
+    def __init__(self, hass, service, host=None):
+        """Initialize the events of the call of service, on host if several."""
+        self.hass = hass
+        self.service = service
+        self.host = host
+        self._buffer = bytearray()
+
+    def __call__(self, chunk):
+        """Fire the events of the complete lines of a chunk of output."""
+        self._buffer += chunk
+        *lines, rest = self._buffer.split(b"\n")
+        self._buffer = bytearray(rest)
+        for line in lines:
+            self._fire(line)
+
+    def flush(self):
+        """Fire the event of the last line, if not terminated."""
+        if self._buffer:
+            self._fire(self._buffer)
+            self._buffer = bytearray()
+
+    def _fire(self, line):
+        event_data = {
+            "service": self.service.service,
+            "line": line.decode("utf-8", "replace").rstrip("\r"),
+        }
+        if self.host is not None:
+            event_data["host"] = self.host
+        self.hass.bus.async_fire(EVENT_OUTPUT, event_data, context=self.service.context)
+
+
+def _host_services(hass, dom_conf, name, conf):
+    """Return the (host, CommandData) running the command of a service on each of its hosts.
+
+    The hosts of the configuration use their SSH options, the other members of
+    the groups the SSH options of the service.
+    """
+    hosts = dom_conf[CONF_HOSTS]
+    targets = []
+    for target in conf[CONF_HOSTS]:
+        for host in dom_conf[CONF_GROUPS].get(target, [target]):
+            if host not in targets:
+                targets.append(host)
+    datas = []
+    for target in targets:
+        if target in hosts:
+            host_conf = {
+                **{k: v for k, v in hosts[target].items() if k != CONF_ENTITIES},
+                CONF_COMMAND_TIMEOUT: conf[CONF_COMMAND_TIMEOUT],
+                CONF_STREAM_OUTPUT: conf[CONF_STREAM_OUTPUT],
+            }
+        else:
+            host_conf = {**conf, CONF_SSH_HOST: target}
+        datas.append(
+            (
+                target,
+                CommandData(
+                    hass, host_conf, conf[CONF_COMMAND], action=True, name=f"{DOMAIN}.{name}"
+                ),
+            )
+        )
+    return datas
+
+
+async def _async_setup_host(hass, coordinator, name, host_conf, config):
+    """Set up the entities declared for a host, then poll them."""
+    platforms = {}
+    for entity_conf in host_conf[CONF_ENTITIES]:
+        platforms.setdefault(entity_conf[CONF_PLATFORM], []).append(entity_conf)
+    await asyncio.gather(
+        *(
+            discovery.async_load_platform(
+                hass,
+                platform,
+                DOMAIN,
+                {CONF_HOST_GROUP: name, CONF_ENTITIES: entity_confs},
+                config,
+            )
+            for platform, entity_confs in platforms.items()
+        )
+    )
+    await coordinator.async_refresh()
+
+
+@callback
+def _async_setup_discovered(hass, dom_conf, config):
+    """Set up the coordinators of the hosts, their entities and the statistics sensors."""
+    coordinators = hass.data.setdefault(DATA_COORDINATORS, {})
+    for name, host_conf in dom_conf.get(CONF_HOSTS, {}).items():
+        coordinators[name] = HostCoordinator(
+            hass, name, host_conf, get_scheduler(hass), get_stats(hass)
+        )
+        hass.async_create_task(
+            _async_setup_host(hass, coordinators[name], name, host_conf, config)
+        )
+
+    if dom_conf.get(CONF_STATS):
+        hass.async_create_task(
+            discovery.async_load_platform(hass, Platform.SENSOR, DOMAIN, {}, config)
+        )
+    elif remove_listener := hass.data.pop(DATA_STATS_LISTENER, None):
+        remove_listener()
+
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """Set up the remote_command_line component."""
     dom_conf = config.get(DOMAIN, {})
+    hass.data[DATA_SCHEDULER] = CommandScheduler(
+        dom_conf.get(CONF_MAX_CONCURRENT, DEFAULT_MAX_CONCURRENT),
+        dom_conf.get(CONF_POLL_JITTER, 0),
+    )
+
+    services: dict[str, CommandData] = {}
+    host_services: dict[str, list[tuple[str, CommandData]]] = {}
 
-    async def async_service_handler(service: ServiceCall) -> None:
-        """Execute a shell command service."""
-        conf = dom_conf[service.service]
-        timeout = (
-            service.data[CONF_COMMAND_TIMEOUT]
-            if CONF_COMMAND_TIMEOUT in service.data
-            else conf[CONF_COMMAND_TIMEOUT]
+    async def async_run_service(service, data, host=None):
+        """Run the command of a service, returning its result."""
+        events = None
+        if service.data.get(CONF_STREAM_OUTPUT, data.config[CONF_STREAM_OUTPUT]):
+            events = OutputEvents(hass, service, host)
+        result = await data.async_run(
+            service.data.get(CONF_COMMAND_TIMEOUT), with_stderr=True, output_callback=events
         )
+        if events is not None:
+            events.flush()
+        _LOGGER.debug("-- output: '%s'", result.output)
+        return result.as_dict()
 
-        try:
-            cmd: template.Template = conf[CONF_COMMAND]
-            if cmd and hass:
-                cmd.hass = hass
-            command = cmd.render()
-        except TemplateError as ex:
-            _LOGGER.exception("Error rendering command template: %s", ex)
+    async def async_service_handler(service: ServiceCall) -> ServiceResponse:
+        """Execute a shell command service, returning its result."""
+        if service.service not in host_services:
+            return await async_run_service(service, services[service.service])
+
+        semaphore = asyncio.Semaphore(dom_conf[service.service][CONF_PARALLELISM])
+
+        async def async_run_on_host(host, data):
+            async with semaphore:
+                return {"host": host, **await async_run_service(service, data, host)}
+
+        return {
+            "results": await asyncio.gather(
+                *(async_run_on_host(host, data) for host, data in host_services[service.service])
+            )
+        }
+
+    async def async_close_connections(event: Event) -> None:
+        """Close the pooled SSH connections."""
+        pool = hass.data.pop(DATA_POOL, None)
+        if pool:
+            await pool.async_close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close_connections)
+
+    async def async_get_stats(service: ServiceCall) -> ServiceResponse:
+        """Return the execution statistics."""
+        return get_stats(hass).as_dict()
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_STATS,
+        async_get_stats,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+    _async_setup_discovered(hass, dom_conf, config)
+
+    async def async_reload_discovered(event: Event) -> None:
+        """Set up the discovered entities again, the reload having removed them."""
+        reloaded = await async_integration_yaml_config(hass, DOMAIN)
+        if reloaded is None:
             return
-        ssh_user = conf.get(CONF_SSH_USER)
-        ssh_host = conf.get(CONF_SSH_HOST)
-        ssh_key = conf.get(CONF_SSH_KEY)
-        if not ssh_user and not ssh_host and not ssh_key:
-            ssh_command = command
-        else:
-            if not ssh_key:
-                home = str(Path.home())
-                if not os.path.isfile("/config/.ssh/id_rsa") and not os.path.isfile(
-                    home + "/.ssh/id_rsa"
-                ):
-                    await hass.async_add_executor_job(
-                        call_shell_with_value,
-                        "mkdir /config/.ssh && ssh-keygen -q -b 2048 -t rsa -N '' -f /config/.ssh/id_rsa",
-                        30,
-                    )
-                ssh_key = "/config/.ssh/id_rsa"
-            escaped_command = command.replace("'", "''")
-            command_key = ""
-            command_target = ""
-            command_user = ssh_user
-            if ssh_key:
-                command_key = f"-i {ssh_key}"
-            if ssh_host:
-                command_target = ssh_host
-            else:
-                command_target = "172.17.0.1"
-
-            ssh_command = f"ssh -4 -o ConnectTimeout=3 -o StrictHostKeyChecking=no {command_key} {command_user}@{command_target} '{escaped_command}'"
+        for coordinator in hass.data.pop(DATA_COORDINATORS, {}).values():
+            await coordinator.async_shutdown()
+        _async_setup_discovered(hass, reloaded.get(DOMAIN, {}), reloaded)
 
-        _LOGGER.debug("Running command: %s", command)
-        ret = await hass.async_add_executor_job(
-            call_shell_with_value, ssh_command, timeout
-        )
-        _LOGGER.debug("-- output: '%s'", ret)
+    await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
+    hass.bus.async_listen(f"event_{DOMAIN}_reloaded", async_reload_discovered)
 
     for name in dom_conf:
-        hass.services.async_register(DOMAIN, name, async_service_handler)
+        if name in DOMAIN_SETTINGS:
+            continue
+        conf = dom_conf[name]
+        if CONF_HOSTS in conf:
+            host_services[name] = _host_services(hass, dom_conf, name, conf)
+        else:
+            services[name] = CommandData(
+                hass, conf, conf[CONF_COMMAND], action=True, name=f"{DOMAIN}.{name}"
+            )
+        hass.services.async_register(
+            DOMAIN,
+            name,
+            async_service_handler,
+            schema=SERVICE_CALL_SCHEMA,
+            supports_response=SupportsResponse.OPTIONAL,
+        )
     return True
@@ -0,0 +1,164 @@
+"""Run the commands of many entities from one agent process per host.
+
+The agent is a small Python 3 script started over the SSH connection of the
+host. It runs each command on its own schedule on the host and reports the
+result, as a JSON line, only when it differs from the previous one.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import shlex
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import DATA_AGENTS
+from .stream import CommandStream
+
+_LOGGER = logging.getLogger(__name__)
+
+# Delay letting the entities set up together register before (re)starting
+RESTART_DELAY = 1
+
+AGENT_SCRIPT = r"""
+import json, os, subprocess, sys, threading, time
+
+lock = threading.Lock()
+
+
+def emit(message):
+    try:
+        with lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+    except OSError:
+        os._exit(0)
+
+
+def watch(key, command, interval, timeout):
+    last = None
+    while True:
+        started = time.monotonic()
+        try:
+            proc = subprocess.run(
+                command,
+                shell=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=timeout,
+            )
+            result = [proc.returncode, proc.stdout.decode("utf-8", "replace")]
+        except subprocess.TimeoutExpired:
+            result = [None, ""]
+        if result != last:
+            last = result
+            emit({"id": key, "rc": result[0], "out": result[1]})
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+for key, spec in json.loads(sys.argv[1]).items():
+    threading.Thread(target=watch, args=[key] + spec, daemon=True).start()
+while True:
+    # Exit once the connection to Home Assistant is gone
+    emit({})
+    time.sleep(30)
+"""
+
+
+class HostAgent(CommandStream):
+    """Supervise the agent of a host, dispatching its results to the entities."""
+
+    def __init__(self, hass, data, connection):
+        """Initialize the agent, started with the options of data."""
+        host = connection.host if connection else "localhost"
+        super().__init__(hass, data, self._async_handle_line, f"agent on {host}")
+        self.connection = connection
+        self._commands: dict[str, tuple] = {}
+        self._next_key = 0
+        self._restart_cancel = None
+
+    @callback
+    def async_add(self, command, interval, timeout, value_callback):
+        """Add a command to run every interval seconds, returning its remove callback."""
+        key = str(self._next_key)
+        self._next_key += 1
+        self._commands[key] = (command, interval, timeout, value_callback)
+        self._async_schedule_restart()
+
+        @callback
+        def async_remove():
+            self._commands.pop(key, None)
+            self._async_schedule_restart()
+
+        return async_remove
+
+    @callback
+    def _async_schedule_restart(self):
+        """Restart the agent with the current commands, once they settled."""
+        if self._restart_cancel:
+            self._restart_cancel()
+        self._restart_cancel = async_call_later(self.hass, RESTART_DELAY, self._async_restart)
+
+    async def _async_restart(self, _now):
+        """Restart the agent."""
+        self._restart_cancel = None
+        await self.async_stop()
+        if self._commands:
+            self.async_start()
+
+    def command_line(self):
+        """Return the command starting the agent with the current commands."""
+        spec = {
+            key: [command, interval, timeout]
+            for key, (command, interval, timeout, _) in self._commands.items()
+        }
+        return (
+            f"python3 -u -c {shlex.quote(AGENT_SCRIPT)} {shlex.quote(json.dumps(spec))}"
+        )
+
+    async def _async_run(self):
+        """Run the agent once, until it exits."""
+        _LOGGER.debug("Starting %s with %d commands", self.name, len(self._commands))
+        return await self.data.async_stream(
+            self.command_line(), self.connection, self._line_callback
+        )
+
+    @callback
+    def _async_handle_line(self, line):
+        """Pass a result of the agent to its entity."""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            _LOGGER.warning("Unexpected output from %s: %s", self.name, line)
+            return
+        if not message or message.get("id") not in self._commands:
+            return
+        command, _, _, value_callback = self._commands[message["id"]]
+        returncode = message.get("rc")
+        if returncode is None:
+            _LOGGER.error("Timeout for command: %s", command)
+            value_callback("Error: Timeout for command")
+        elif returncode != 0:
+            _LOGGER.error("Command failed: %s", command)
+            value_callback("Error: Command failed")
+        else:
+            value_callback(message.get("out", "").strip())
+
+
+async def async_add_agent_command(hass, data, interval, value_callback):
+    """Run the command of data in the agent of its host.
+
+    Return the callback removing the command, or None if it could not be added.
+    """
+    prepared = await data.async_prepare()
+    if prepared is None:
+        return None
+    command, connection = prepared
+    agents = hass.data.setdefault(DATA_AGENTS, {})
+    if connection not in agents:
+        agents[connection] = HostAgent(hass, data, connection)
+    return agents[connection].async_add(
+        command, interval.total_seconds(), data.timeout, value_callback
+    )
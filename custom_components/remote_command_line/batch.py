@@ -0,0 +1,144 @@
+"""Coalesce the commands sent to one SSH target into a single invocation."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import secrets
+import shlex
+
+from .const import OUTPUT_HEAD
+from .scheduler import PRIORITY_POLL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+LOGIN_SHELL = '"${SHELL:-sh}"'
+
+
+def build_script(token, commands, parallelism=None, shell=LOGIN_SHELL, caps=None):
+    """Build a shell script running commands in parallel with framed output.
+
+    Each command is run by shell, the login shell of the remote user by
+    default, at most parallelism at a time. caps gives for each command None or
+    the (limit, keep) of its output, which is then cut one byte past limit so
+    that its truncation can be told. The output of each command is followed by
+    a trailer line "<token> <index> <returncode> <start ns> <end ns>".
+    """
+    lines = ['d=$(mktemp -d) || exit 255']
+    for index, command in enumerate(commands):
+        if parallelism and index and index % parallelism == 0:
+            lines.append("wait")
+        run = f"{shell} -c {shlex.quote(command)} 2>/dev/null </dev/null"
+        trailer = f"echo \"$? $s $(date +%s%N)\" >\"$d/{index}.rc\""
+        cap = caps[index] if caps else None
+        if cap is None:
+            body = f"{run} >\"$d/{index}\"; {trailer}"
+        else:
+            limit, keep = cap
+            cut = "head" if keep == OUTPUT_HEAD else "tail"
+            body = f"{{ {run}; {trailer}; }} | {cut} -c {limit + 1} >\"$d/{index}\""
+        lines.append(f"( s=$(date +%s%N); {body} ) &")
+    lines.append("wait")
+    lines.append(
+        f"for i in {' '.join(str(index) for index in range(len(commands)))}; do"
+        f" cat \"$d/$i\"; printf '\\n%s %s %s\\n' {token} \"$i\" \"$(cat \"$d/$i.rc\")\"; done"
+    )
+    lines.append('rm -rf "$d"')
+    return "\n".join(lines) + "\n"
+
+
+def parse_output(token, output):
+    """Split a framed batch output into {index: (returncode, stdout, duration)}."""
+    results = {}
+    marker = b"\n" + token.encode("utf-8") + b" "
+    position = 0
+    while True:
+        start = output.find(marker, position)
+        if start < 0:
+            break
+        end = output.find(b"\n", start + len(marker))
+        if end < 0:
+            end = len(output)
+        fields = output[start + len(marker) : end].split()
+        try:
+            index = int(fields[0])
+            returncode = int(fields[1])
+        except (IndexError, ValueError):
+            break
+        try:
+            duration = (int(fields[3]) - int(fields[2])) / 1e9
+        except (IndexError, ValueError):
+            duration = None
+        results[index] = (returncode, output[position:start], duration)
+        position = end + 1
+    return results
+
+
+class CommandBatcher:
+    """Run the commands queued within a time window in one remote round-trip."""
+
+    def __init__(self, window, connection, scheduler, limit):
+        """Initialize the batcher."""
+        self._window = window
+        self._connection = connection
+        self._scheduler = scheduler
+        self._limit = limit
+        self._queue: list[tuple[str, int, int, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def async_exec(self, command, timeout, stdin=None, priority=PRIORITY_POLL):
+        """Queue a command and return its (returncode, stdout) once run."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((command, timeout, priority, future))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self):
+        """Start running the queued commands."""
+        self._flush_handle = None
+        batch, self._queue = self._queue, []
+        asyncio.get_running_loop().create_task(self._async_run_batch(batch))
+
+    async def _async_run_batch(self, batch):
+        """Run a batch as a single scheduled command."""
+        commands = [command for command, _, _, _ in batch]
+        timeout = max(timeout for _, timeout, _, _ in batch)
+        priority = min(priority for _, _, priority, _ in batch)
+        if len(batch) == 1:
+            # Run as it would be without batching
+            args = (commands[0], timeout)
+        else:
+            token = f"__rcl_{secrets.token_hex(8)}__"
+            script = build_script(token, commands, self._limit)
+            args = ("sh -s", timeout, script.encode("utf-8"))
+
+        _LOGGER.debug("Running %d batched commands: %s", len(batch), commands)
+        try:
+            returncode, output = await self._scheduler.async_run(
+                self._connection.host,
+                self._limit,
+                priority,
+                self._connection.async_exec,
+                *args,
+            )
+        except (asyncio.TimeoutError, OSError) as ex:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(type(ex)(*ex.args))
+            return
+
+        if len(batch) == 1:
+            results = {0: (returncode, output, None)}
+        else:
+            results = parse_output(token, output)
+
+        for index, (command, _, _, future) in enumerate(batch):
+            # A missing frame means the batch itself failed, e.g. ssh exiting 255
+            result_code, stdout, duration = results.get(index, (returncode or 255, b"", None))
+            _LOGGER.debug(
+                "Batched command %s exited with %s in %ss", command, result_code, duration
+            )
+            if not future.done():
+                future.set_result((result_code, stdout))
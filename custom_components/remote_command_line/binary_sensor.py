@@ -1,5 +1,7 @@
 """Support for custom shell commands to retrieve values."""
 from datetime import timedelta
+from functools import partial
+import logging
 
 import voluptuous as vol
 
@@ -11,15 +13,45 @@ from homeassistant.const import (
     CONF_COMMAND,
     CONF_DEVICE_CLASS,
     CONF_NAME,
+    CONF_SCAN_INTERVAL,
     CONF_PAYLOAD_OFF,
     CONF_PAYLOAD_ON,
+    CONF_SENSORS,
     CONF_VALUE_TEMPLATE,
+    STATE_OFF,
+    STATE_ON,
 )
+from homeassistant.core import callback
+from homeassistant.exceptions import TemplateError
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.reload import setup_reload_service
+from homeassistant.helpers.reload import async_setup_reload_service
 
 from . import CommandData
-from .const import BASE_SSH_PLATFORM_SCHEMA, CONF_COMMAND_TIMEOUT, CONF_POLLING, DEFAULT_TIMEOUT, DOMAIN, PLATFORMS
+from .const import (
+    ADAPTIVE_POLLING_SCHEMA,
+    BASE_SSH_PLATFORM_SCHEMA,
+    CONF_ADAPTIVE_POLLING,
+    CONF_COMMAND_TIMEOUT,
+    CONF_MODE,
+    CONF_POLLING,
+    CONF_STARTUP_REFRESH,
+    CONF_VALUE_JSON_PATH,
+    DEFAULT_TIMEOUT,
+    DOMAIN,
+    MODE_AGENT,
+    MODE_POLL,
+    MODE_STREAM,
+    PLATFORMS,
+    STARTUP_DEFERRED,
+    STARTUP_IMMEDIATE,
+    STARTUP_REFRESH_SCHEMA,
+)
+from .coordinator import async_setup_host_entities, async_setup_shared_entities
+from .entity import CommandEntity
+from .json_select import compile_selector, json_selector, select, to_text
+from .polling import AdaptivePolling
+
+_LOGGER = logging.getLogger(__name__)
 
 DEFAULT_NAME = "Binary Command Sensor"
 DEFAULT_PAYLOAD_ON = "ON"
@@ -27,6 +59,17 @@ DEFAULT_PAYLOAD_OFF = "OFF"
 
 SCAN_INTERVAL = timedelta(seconds=60)
 
+# Binary sensor taking its state from the output of the command of the platform
+SHARED_SENSOR_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_NAME): cv.string,
+        vol.Optional(CONF_PAYLOAD_OFF, default=DEFAULT_PAYLOAD_OFF): cv.string,
+        vol.Optional(CONF_PAYLOAD_ON, default=DEFAULT_PAYLOAD_ON): cv.string,
+        vol.Optional(CONF_DEVICE_CLASS): DEVICE_CLASSES_SCHEMA,
+        vol.Exclusive(CONF_VALUE_TEMPLATE, "value"): cv.template,
+        vol.Exclusive(CONF_VALUE_JSON_PATH, "value"): json_selector,
+    }
+)
 
 PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
     {
@@ -38,14 +81,23 @@ PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
         vol.Optional(CONF_POLLING, default=True): cv.boolean,
+        vol.Optional(CONF_MODE, default=MODE_POLL): vol.In([MODE_POLL, MODE_STREAM, MODE_AGENT]),
+        vol.Optional(CONF_ADAPTIVE_POLLING): ADAPTIVE_POLLING_SCHEMA,
+        vol.Optional(CONF_STARTUP_REFRESH, default=STARTUP_DEFERRED): STARTUP_REFRESH_SCHEMA,
+        vol.Optional(CONF_SENSORS): vol.All(cv.ensure_list, [SHARED_SENSOR_SCHEMA]),
     }
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Command line Binary Sensor."""
+    if discovery_info is not None:
+        await async_setup_host_entities(
+            hass, discovery_info, PLATFORM_SCHEMA, async_setup_platform, async_add_entities
+        )
+        return
 
-    setup_reload_service(hass, DOMAIN, PLATFORMS)
+    await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
 
     name = config.get(CONF_NAME)
     command = config.get(CONF_COMMAND)
@@ -55,48 +107,149 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     value_template = config.get(CONF_VALUE_TEMPLATE)
     if value_template is not None:
         value_template.hass = hass
-    polling = config.get(CONF_POLLING)
+    mode = config.get(CONF_MODE)
+    polling = config.get(CONF_POLLING) and mode == MODE_POLL
+    startup_refresh = config.get(CONF_STARTUP_REFRESH, STARTUP_DEFERRED)
     data = CommandData(hass, config, command)
+    adaptive = None
+    if polling and CONF_ADAPTIVE_POLLING in config:
+        adaptive = AdaptivePolling(data, config[CONF_ADAPTIVE_POLLING])
+
+    if CONF_SENSORS in config:
+        await async_setup_shared_entities(
+            hass,
+            config,
+            data,
+            polling,
+            config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL),
+            async_add_entities,
+            partial(_create_shared_sensor, hass, data),
+        )
+        return
 
-    add_entities(
+    async_add_entities(
         [
             CommandBinarySensor(
-                hass, data, name, device_class, payload_on, payload_off, value_template, polling
+                hass,
+                data,
+                name,
+                device_class,
+                payload_on,
+                payload_off,
+                value_template,
+                polling,
+                mode,
+                adaptive,
+                config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL),
+                startup_refresh,
             )
         ],
-        polling,
+        polling and startup_refresh == STARTUP_IMMEDIATE,
     )
 
 
-class CommandBinarySensor(BinarySensorEntity):
+def _create_shared_sensor(hass, data, sensor_config, coordinator):
+    """Return a binary sensor taking its state from the output of coordinator."""
+    value_template = sensor_config.get(CONF_VALUE_TEMPLATE)
+    if value_template is not None:
+        value_template.hass = hass
+    return CommandBinarySensor(
+        hass,
+        data,
+        sensor_config[CONF_NAME],
+        sensor_config.get(CONF_DEVICE_CLASS),
+        sensor_config[CONF_PAYLOAD_ON],
+        sensor_config[CONF_PAYLOAD_OFF],
+        value_template,
+        False,
+        value_json_path=sensor_config.get(CONF_VALUE_JSON_PATH),
+        coordinator=coordinator,
+    )
+
+
+class CommandBinarySensor(CommandEntity, BinarySensorEntity):
     """Representation of a command line binary sensor."""
 
     def __init__(
-        self, hass, data, name, device_class, payload_on, payload_off, value_template, polling
+        self,
+        hass,
+        data,
+        name,
+        device_class,
+        payload_on,
+        payload_off,
+        value_template,
+        polling,
+        mode=MODE_POLL,
+        adaptive=None,
+        scan_interval=SCAN_INTERVAL,
+        startup_refresh=STARTUP_IMMEDIATE,
+        value_json_path=None,
+        coordinator=None,
     ):
         """Initialize the Command line binary sensor."""
+        super().__init__(
+            data, polling, mode, adaptive, scan_interval, startup_refresh, coordinator
+        )
         self._hass = hass
-        self.data = data
         self._attr_name = name
         self._attr_device_class = device_class
         self._state = False
         self._payload_on = payload_on
         self._payload_off = payload_off
         self._value_template = value_template
-        self._attr_should_poll = polling
+        self._value_json_path = compile_selector(value_json_path) if value_json_path else None
 
     @property
     def is_on(self):
         """Return true if the binary sensor is on."""
         return self._state
 
-    def update(self):
+    async def _async_restore(self):
+        """Restore the last known state."""
+        last_state = await self.async_get_last_state()
+        if last_state is not None and last_state.state in (STATE_ON, STATE_OFF):
+            self._state = last_state.state == STATE_ON
+
+    @callback
+    def _async_handle_line(self, line):
+        """Update the state from a line of the stream command."""
+        self.data.set_value(line)
+        if self.data.changed:
+            self._process_value(line)
+            self.async_write_ha_state()
+
+    async def async_update(self):
         """Get the latest data and updates the state."""
-        self.data.update(with_value=True)
-        value = self.data.value
+        if self._coordinator:
+            if self._coordinator.data is not None:
+                self._process_value(*self._coordinator.data)
+            return
+        await self.data.async_update(with_value=True)
+        if self.data.changed:
+            self._process_value(self.data.value)
 
-        if self._value_template is not None:
-            value = self._value_template.render_with_possible_json_value(value, False)
+    def _process_value(self, value, json_value=None):
+        """Update the state from a command output, decoded beforehand if json_value."""
+        if value is None:
+            return
+        if self._value_json_path is not None:
+            try:
+                value = to_text(select(json_value, self._value_json_path))
+            except LookupError:
+                _LOGGER.warning("No value for %s in the output: %s", self.name, value)
+                return
+        elif self._value_template is not None and self._coordinator:
+            variables = {"value": value}
+            if json_value is not None:
+                variables["value_json"] = json_value
+            try:
+                value = self._value_template.async_render(variables, parse_result=False)
+            except TemplateError as ex:
+                _LOGGER.error("Error parsing value: %s (value: %s)", ex, value)
+                return
+        elif self._value_template is not None:
+            value = self._value_template.async_render_with_possible_json_value(value, False)
         if value == self._payload_on:
             self._state = True
         elif value == self._payload_off:
@@ -0,0 +1,118 @@
+"""Fail the commands of unreachable SSH hosts fast."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3
+MIN_BACKOFF = 10
+MAX_BACKOFF = 600
+# Exit code of ssh when the connection fails
+SSH_ERROR = 255
+
+
+class HostUnreachable(OSError):
+    """The circuit of the host is open."""
+
+
+class CircuitBreaker:
+    """Track whether a host is reachable.
+
+    After threshold consecutive failed connections or exits with SSH_ERROR,
+    the circuit opens and the commands to the host fail immediately with
+    HostUnreachable. Once the backoff elapsed, the next command probes the
+    host: the circuit closes if it succeeds, otherwise the backoff doubles, up
+    to max_backoff. Commands running longer than their timeout say nothing of
+    the host and are not counted, a probe timing out waits for the next one.
+    """
+
+    def __init__(
+        self,
+        host,
+        threshold=FAILURE_THRESHOLD,
+        min_backoff=MIN_BACKOFF,
+        max_backoff=MAX_BACKOFF,
+    ):
+        """Initialize the circuit, closed."""
+        self.host = host
+        self.threshold = threshold
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.backoff = min_backoff
+        self._retry_at: float | None = None
+        self._probing = False
+
+    @property
+    def closed(self):
+        """Return whether the commands to the host are run."""
+        return self._retry_at is None
+
+    def check(self):
+        """Raise HostUnreachable if the circuit is open and not due for a probe."""
+        if self._retry_at is None:
+            return
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise HostUnreachable(
+                f"{self.host} is unreachable, next attempt in {self._retry_at - now:.0f}s"
+            )
+        # This command probes the host, the others keep failing meanwhile
+        self._retry_at = now + self.backoff
+        self._probing = True
+
+    async def async_call(self, func, *args, **kwargs):
+        """Await func unless the circuit is open, recording its outcome.
+
+        func returns a returncode or a (returncode, output) tuple.
+        """
+        self.check()
+        try:
+            result = await func(*args, **kwargs)
+        except HostUnreachable:
+            raise
+        except asyncio.TimeoutError:
+            self._probing = False
+            raise
+        except OSError:
+            self._record_failure()
+            raise
+        returncode = result[0] if isinstance(result, tuple) else result
+        if returncode == SSH_ERROR:
+            self._record_failure()
+        else:
+            self._record_success()
+        return result
+
+    def _record_success(self):
+        """Close the circuit."""
+        if self._retry_at is not None:
+            _LOGGER.info("%s is reachable again", self.host)
+        self.failures = 0
+        self.backoff = self.min_backoff
+        self._retry_at = None
+        self._probing = False
+
+    def _record_failure(self):
+        """Open the circuit after threshold failures, backing off further if already open."""
+        self.failures += 1
+        if self._retry_at is not None:
+            if not self._probing:
+                # Started before the circuit opened
+                return
+            self._probing = False
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            _LOGGER.debug("%s still unreachable, next attempt in %ss", self.host, self.backoff)
+        elif self.failures < self.threshold:
+            return
+        else:
+            _LOGGER.warning(
+                "%s failed %d times in a row, failing its commands for %ss",
+                self.host,
+                self.failures,
+                self.backoff,
+            )
+        self._retry_at = time.monotonic() + self.backoff
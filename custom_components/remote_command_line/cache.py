@@ -0,0 +1,61 @@
+"""Share command results between entities running the same command."""
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+import time
+
+
+class ResultCache:
+    """LRU cache of command results with single-flight execution."""
+
+    def __init__(self, max_size):
+        """Initialize the cache."""
+        self._max_size = max_size
+        # key -> (fetch time, ttl, result)
+        self._entries: OrderedDict[tuple, tuple[float, float, tuple]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+
+    async def async_exec(self, key, ttl, exec_func, command, timeout, stdin=None):
+        """Return the result of exec_func for key.
+
+        A result younger than ttl seconds, whoever fetched it, is returned
+        without running anything, and concurrent calls for the same key await a
+        single execution. Results are only kept for a ttl greater than 0.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and ttl and entry[0] + ttl > time.monotonic():
+            # Kept for as long as the longest ttl of its readers
+            self._entries[key] = (entry[0], max(entry[1], ttl), entry[2])
+            self._entries.move_to_end(key)
+            return entry[2]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(
+                self._async_fetch(key, ttl, exec_func(command, timeout, stdin))
+            )
+            # The exception is retrieved even if every caller got cancelled
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _async_fetch(self, key, ttl, coro):
+        """Run a command and store its result."""
+        try:
+            result = await coro
+        finally:
+            del self._inflight[key]
+        now = time.monotonic()
+        for expired in [
+            expired
+            for expired, (fetched, kept, _) in self._entries.items()
+            if fetched + kept <= now
+        ]:
+            del self._entries[expired]
+        if ttl:
+            self._entries[key] = (now, ttl, result)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return result
@@ -1,4 +1,6 @@
 """Allows to configure custom shell commands to turn a value for a sensor."""
+from datetime import timedelta
+
 from homeassistant.helpers.config_validation import (  # noqa: F401
     PLATFORM_SCHEMA,
 )
@@ -6,6 +8,9 @@ import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
 
 CONF_COMMAND_TIMEOUT = "command_timeout"
+CONF_MAX_CONCURRENT = "max_concurrent"
+CONF_POLL_JITTER = "poll_jitter"
+CONF_STATS = "stats"
 DEFAULT_TIMEOUT = 15
 DOMAIN = "remote_command_line"
 PLATFORMS = ["binary_sensor", "cover", "sensor", "switch"]
@@ -13,12 +18,119 @@ PLATFORMS = ["binary_sensor", "cover", "sensor", "switch"]
 CONF_SSH_USER = "ssh_user"
 CONF_SSH_HOST = "ssh_host"
 CONF_SSH_KEY = "ssh_key"
+CONF_SSH_MULTIPLEX = "ssh_multiplex"
+CONF_SSH_IDLE_TIMEOUT = "ssh_idle_timeout"
+CONF_SSH_MAX_SESSIONS = "ssh_max_sessions"
+CONF_SSH_BATCH_WINDOW = "ssh_batch_window"
+CONF_SSH_BACKEND = "ssh_backend"
+CONF_CACHE_TTL = "cache_ttl"
+CONF_MAX_OUTPUT_BYTES = "max_output_bytes"
+CONF_OUTPUT_KEEP = "output_keep"
 CONF_POLLING = "polling"
+CONF_MODE = "mode"
+CONF_ADAPTIVE_POLLING = "adaptive_polling"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_MAX_INTERVAL = "max_interval"
+CONF_BURST_INTERVAL = "burst_interval"
+CONF_BURST_DURATION = "burst_duration"
+CONF_COMMAND_SET_POSITION = "command_set_position"
+CONF_STARTUP_REFRESH = "startup_refresh"
+CONF_HOSTS = "hosts"
+CONF_ENTITIES = "entities"
+CONF_GROUPS = "groups"
+CONF_PARALLELISM = "parallelism"
+CONF_STREAM_OUTPUT = "stream_output"
+CONF_VALUE_JSON_PATH = "value_json_path"
+# Set on the configuration of the entities declared under a host
+CONF_HOST_GROUP = f"{DOMAIN}_host"
+
+MODE_POLL = "poll"
+MODE_STREAM = "stream"
+MODE_AGENT = "agent"
+
+BACKEND_OPENSSH = "openssh"
+BACKEND_ASYNCSSH = "asyncssh"
+# Installed on the first use of the asyncssh backend
+ASYNCSSH_REQUIREMENT = "asyncssh>=2.14.2"
+
+STARTUP_IMMEDIATE = "immediate"
+STARTUP_DEFERRED = "deferred"
+STARTUP_NONE = "none"
+
+OUTPUT_HEAD = "head"
+OUTPUT_TAIL = "tail"
+
+DEFAULT_SSH_KEY = "/config/.ssh/id_rsa"
+DEFAULT_SSH_IDLE_TIMEOUT = 300
+DEFAULT_SSH_MAX_SESSIONS = 10
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_MAX_CONCURRENT = 32
+DEFAULT_PARALLELISM = 10
+DEFAULT_SCAN_INTERVAL = timedelta(seconds=60)
+DEFAULT_MIN_INTERVAL = timedelta(seconds=10)
+DEFAULT_MAX_INTERVAL = timedelta(minutes=10)
+DEFAULT_BURST_INTERVAL = timedelta(seconds=2)
+DEFAULT_BURST_DURATION = timedelta(seconds=30)
+
+DATA_POOL = f"{DOMAIN}_pool"
+DATA_BATCHERS = f"{DOMAIN}_batchers"
+DATA_CACHE = f"{DOMAIN}_cache"
+DATA_SCHEDULER = f"{DOMAIN}_scheduler"
+DATA_STATS = f"{DOMAIN}_stats"
+DATA_STATS_LISTENER = f"{DOMAIN}_stats_listener"
+DATA_AGENTS = f"{DOMAIN}_agents"
+DATA_COORDINATORS = f"{DOMAIN}_coordinators"
+DATA_STARTUP_SLOT = f"{DOMAIN}_startup_slot"
+DATA_SSH_KEY = f"{DOMAIN}_ssh_key"
+DATA_SSH_KEY_LOCK = f"{DOMAIN}_ssh_key_lock"
+DATA_SSH_KEYS_CHECKED = f"{DOMAIN}_ssh_keys_checked"
+
+EVENT_OUTPUT = f"{DOMAIN}_output"
+
+SERVICE_GET_STATS = "get_stats"
+
+SIGNAL_STATS_HOST = f"{DOMAIN}_stats_host"
 
 BASE_SSH_SCHEMA = {
         vol.Optional(CONF_SSH_USER): cv.string,
         vol.Optional(CONF_SSH_HOST): cv.string,
         vol.Optional(CONF_SSH_KEY): cv.string,
+        vol.Optional(CONF_SSH_MULTIPLEX, default=True): cv.boolean,
+        vol.Optional(CONF_SSH_IDLE_TIMEOUT, default=DEFAULT_SSH_IDLE_TIMEOUT): cv.positive_int,
+        vol.Optional(CONF_SSH_MAX_SESSIONS, default=DEFAULT_SSH_MAX_SESSIONS): cv.positive_int,
+        vol.Optional(CONF_SSH_BATCH_WINDOW, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional(CONF_SSH_BACKEND, default=BACKEND_OPENSSH): vol.In(
+            [BACKEND_OPENSSH, BACKEND_ASYNCSSH]
+        ),
+        vol.Optional(CONF_CACHE_TTL, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional(CONF_MAX_OUTPUT_BYTES): cv.positive_int,
+        vol.Optional(CONF_OUTPUT_KEEP, default=OUTPUT_HEAD): vol.In(
+            [OUTPUT_HEAD, OUTPUT_TAIL]
+        ),
     }
 
 BASE_SSH_PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(BASE_SSH_SCHEMA)
+
+
+def _check_intervals(config):
+    """Check that the minimum polling interval is not above the maximum."""
+    if config[CONF_MIN_INTERVAL] > config[CONF_MAX_INTERVAL]:
+        raise vol.Invalid(f"{CONF_MIN_INTERVAL} must not exceed {CONF_MAX_INTERVAL}")
+    return config
+
+
+STARTUP_REFRESH_SCHEMA = vol.In([STARTUP_IMMEDIATE, STARTUP_DEFERRED, STARTUP_NONE])
+
+ADAPTIVE_POLLING_SCHEMA = vol.All(
+    vol.Schema(
+        {
+            vol.Optional(CONF_MIN_INTERVAL, default=DEFAULT_MIN_INTERVAL): cv.positive_time_period,
+            vol.Optional(CONF_MAX_INTERVAL, default=DEFAULT_MAX_INTERVAL): cv.positive_time_period,
+        }
+    ),
+    _check_intervals,
+)
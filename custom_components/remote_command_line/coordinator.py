@@ -0,0 +1,287 @@
+"""Poll several entities with one command per interval.
+
+The entities declared for a host are polled with one invocation running all
+their commands, those sharing a command take their values from its output.
+"""
+from __future__ import annotations
+
+import asyncio
+from functools import partial
+import logging
+import secrets
+
+import voluptuous as vol
+
+from homeassistant.const import CONF_PLATFORM, CONF_SCAN_INTERVAL, CONF_SENSORS
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from .batch import build_script, parse_output
+from .json_select import decode
+from .const import (
+    CONF_ENTITIES,
+    CONF_HOST_GROUP,
+    CONF_MAX_OUTPUT_BYTES,
+    CONF_OUTPUT_KEEP,
+    CONF_POLLING,
+    CONF_SSH_MAX_SESSIONS,
+    CONF_STARTUP_REFRESH,
+    DATA_COORDINATORS,
+    DOMAIN,
+    STARTUP_DEFERRED,
+    STARTUP_IMMEDIATE,
+)
+from .process import OutputCapture, async_exec, command_result
+from .scheduler import PRIORITY_POLL
+from .startup import async_defer_update
+
+_LOGGER = logging.getLogger(__name__)
+
+# Upper bound of the length of the trailer line framing the output of a command
+FRAME_SIZE = 128
+
+
+class HostCoordinator(DataUpdateCoordinator):
+    """Run the polling commands of the entities of a host in one invocation.
+
+    The data is a dict mapping each registered CommandData to the
+    (returncode, stdout) of its command, or to the exception running it raised.
+    """
+
+    def __init__(self, hass, name, config, scheduler, stats):
+        """Initialize the coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN} {name}",
+            update_interval=config[CONF_SCAN_INTERVAL],
+        )
+        self.ssh_config = {
+            key: value
+            for key, value in config.items()
+            if key not in (CONF_ENTITIES, CONF_SCAN_INTERVAL)
+        }
+        self._scheduler = scheduler
+        self._stats = stats
+        self._datas = []
+
+    @callback
+    def async_add(self, data):
+        """Poll the command of data with the other commands of the host.
+
+        Return the callback removing it.
+        """
+        self._datas.append(data)
+
+        @callback
+        def async_remove():
+            if data in self._datas:
+                self._datas.remove(data)
+
+        return async_remove
+
+    async def async_exec(self, data, command, timeout, stdin=None):
+        """Return the result of the command of data from the last update."""
+        result = (self.data or {}).get(data)
+        if result is None:
+            raise OSError(f"No result yet for {command}")
+        if isinstance(result, Exception):
+            raise type(result)(*result.args)
+        return result
+
+    async def _async_update_data(self):
+        """Run the commands of the host, in one invocation per connection.
+
+        The entities overriding the SSH options of the host get their own
+        connection.
+        """
+        groups = {}
+        for data in list(self._datas):
+            prepared = await data.async_prepare()
+            if prepared is None:
+                continue
+            command, connection = prepared
+            groups.setdefault(connection, []).append((data, command))
+        results = {}
+        for group_results in await asyncio.gather(
+            *(self._async_run(connection, items) for connection, items in groups.items())
+        ):
+            results.update(group_results)
+        return results
+
+    async def _async_run(self, connection, items):
+        """Run the commands of items in one invocation on connection."""
+        datas = [data for data, _ in items]
+        token = f"__rcl_{secrets.token_hex(8)}__"
+        commands = [command for _, command in items]
+        caps = [
+            (data.config[CONF_MAX_OUTPUT_BYTES], data.config.get(CONF_OUTPUT_KEEP))
+            if data.config.get(CONF_MAX_OUTPUT_BYTES)
+            else None
+            for data in datas
+        ]
+        if connection:
+            limit = datas[0].config.get(CONF_SSH_MAX_SESSIONS)
+            script = build_script(token, commands, limit, caps=caps)
+        else:
+            # Run by /bin/sh, like the local commands run alone
+            limit = None
+            script = build_script(token, commands, shell="sh", caps=caps)
+        base_exec = connection.async_exec if connection else async_exec
+        if None not in caps:
+            # Bounds the invocation too, the frames of the commands included
+            capture = OutputCapture(sum(cap[0] + 1 + FRAME_SIZE for cap in caps))
+            base_exec = partial(base_exec, capture=capture)
+        timeout = max(data.timeout or 0 for data in datas) or None
+        host = connection.host if connection else None
+        # Recorded for the host, then for each entity once the output is split
+        recorder = self._stats.recorder(host, None)
+        _LOGGER.debug("Running %d commands of %s on %s", len(items), self.name, host)
+        try:
+            returncode, output = await self._scheduler.async_run(
+                host,
+                limit,
+                PRIORITY_POLL,
+                recorder.wrap(base_exec),
+                "sh -s",
+                timeout,
+                script.encode("utf-8"),
+            )
+        except (asyncio.TimeoutError, OSError) as ex:
+            for data in datas:
+                self._stats.record_entity(
+                    data.stats_name or data.name,
+                    recorder.latency,
+                    recorder.queue_wait,
+                    timeout=isinstance(ex, asyncio.TimeoutError),
+                )
+            return {data: ex for data in datas}
+
+        frames = parse_output(token, output)
+        results = {}
+        for index, (data, command) in enumerate(items):
+            # A missing frame means the invocation itself failed
+            result_code, stdout, duration = frames.get(index, (returncode or 255, b"", None))
+            if caps[index] is not None:
+                capture = OutputCapture(*caps[index])
+                capture.feed(stdout)
+                result_code, stdout = command_result(
+                    command, result_code, capture, OutputCapture()
+                )
+            self._stats.record_entity(
+                data.stats_name or data.name,
+                recorder.latency if duration is None else duration,
+                recorder.queue_wait,
+                result_code,
+                len(stdout),
+            )
+            results[data] = (result_code, stdout)
+        return results
+
+
+class OutputCoordinator(DataUpdateCoordinator):
+    """Run the command of the entities taking their values from its output.
+
+    The data is the (output, decoded JSON) of the last run, the output being
+    decoded once for all the entities. The decoded JSON is None if the output
+    is not JSON or longer than json_max_size. The entities are only updated
+    when the output changed.
+    """
+
+    def __init__(self, hass, data, update_interval, json_max_size=None):
+        """Initialize the coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN} {data.name}",
+            update_interval=update_interval,
+            always_update=False,
+        )
+        self.command_data = data
+        self._json_max_size = json_max_size
+
+    async def _async_update_data(self):
+        """Run the command."""
+        value = await self.command_data.async_update(with_value=True)
+        if not self.command_data.changed and self.data is not None:
+            return self.data
+        return value, decode(value, self._json_max_size)
+
+
+@callback
+def _async_update_entity(entity):
+    """Update an entity from the new data of its coordinator."""
+    if entity.hass is not None:
+        entity.async_schedule_update_ha_state(True)
+
+
+@callback
+def async_listen(coordinator, entity):
+    """Update an entity each time its coordinator got new data."""
+    entity.async_on_remove(
+        coordinator.async_add_listener(partial(_async_update_entity, entity))
+    )
+
+
+async def async_setup_shared_entities(
+    hass,
+    config,
+    data,
+    polling,
+    scan_interval,
+    async_add_entities,
+    create_entity,
+    json_max_size=None,
+):
+    """Add the entities taking their states from the output of one command.
+
+    create_entity returns the entity of an item of the sensors of config, fed by
+    the coordinator it is passed.
+    """
+    # Polled in poll mode only, and by their coordinator for the entities of a host
+    if not polling:
+        _LOGGER.error(
+            "Sensors sharing a command must be polled, in poll mode and outside hosts: %s",
+            data.name,
+        )
+        return
+    coordinator = OutputCoordinator(hass, data, scan_interval, json_max_size)
+    entities = []
+    for entity_config in config[CONF_SENSORS]:
+        entity = create_entity(entity_config, coordinator)
+        async_listen(coordinator, entity)
+        entities.append(entity)
+
+    startup_refresh = config.get(CONF_STARTUP_REFRESH, STARTUP_DEFERRED)
+    if startup_refresh == STARTUP_IMMEDIATE:
+        await coordinator.async_refresh()
+    elif startup_refresh == STARTUP_DEFERRED:
+        async_defer_update(hass, coordinator.async_refresh)
+    async_add_entities(entities)
+
+
+async def async_setup_host_entities(
+    hass, discovery_info, platform_schema, async_setup_platform, async_add_entities
+):
+    """Set up the entities of a platform declared for a host."""
+    name = discovery_info[CONF_HOST_GROUP]
+    coordinator = hass.data[DATA_COORDINATORS][name]
+
+    @callback
+    def async_add_host_entities(entities, update_before_add=False):
+        for entity in entities:
+            async_listen(coordinator, entity)
+        async_add_entities(entities)
+
+    for entity_config in discovery_info[CONF_ENTITIES]:
+        try:
+            config = platform_schema(
+                {**coordinator.ssh_config, **entity_config, CONF_PLATFORM: DOMAIN}
+            )
+        except vol.Invalid as ex:
+            _LOGGER.error("Invalid entity of host %s: %s", name, ex)
+            continue
+        # Polled by the coordinator
+        config[CONF_POLLING] = False
+        config[CONF_HOST_GROUP] = name
+        await async_setup_platform(hass, config, async_add_host_entities)
@@ -1,9 +1,15 @@
 """Support for command line covers."""
+from functools import partial
 import logging
 
 import voluptuous as vol
 
-from homeassistant.components.cover import CoverEntity
+from homeassistant.components.cover import (
+    ATTR_CURRENT_POSITION,
+    ATTR_POSITION,
+    CoverEntity,
+    CoverEntityFeature,
+)
 from homeassistant.const import (
     CONF_COMMAND_CLOSE,
     CONF_COMMAND_OPEN,
@@ -14,10 +20,33 @@ from homeassistant.const import (
     CONF_VALUE_TEMPLATE,
 )
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.reload import setup_reload_service
+from homeassistant.helpers.reload import async_setup_reload_service
+from homeassistant.helpers.restore_state import RestoreEntity
 
 from . import CommandData
-from .const import BASE_SSH_PLATFORM_SCHEMA, CONF_COMMAND_TIMEOUT, CONF_POLLING, DEFAULT_TIMEOUT, DOMAIN, PLATFORMS
+from .const import (
+    ADAPTIVE_POLLING_SCHEMA,
+    BASE_SSH_PLATFORM_SCHEMA,
+    CONF_ADAPTIVE_POLLING,
+    CONF_BURST_DURATION,
+    CONF_BURST_INTERVAL,
+    CONF_COMMAND_SET_POSITION,
+    CONF_COMMAND_TIMEOUT,
+    CONF_HOST_GROUP,
+    CONF_POLLING,
+    CONF_STARTUP_REFRESH,
+    DEFAULT_BURST_DURATION,
+    DEFAULT_BURST_INTERVAL,
+    DEFAULT_TIMEOUT,
+    DOMAIN,
+    PLATFORMS,
+    STARTUP_DEFERRED,
+    STARTUP_IMMEDIATE,
+    STARTUP_REFRESH_SCHEMA,
+)
+from .coordinator import async_setup_host_entities
+from .polling import AdaptivePolling, BurstPolling
+from .startup import async_defer_update
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -27,10 +56,15 @@ COVER_SCHEMA = vol.Schema(
         vol.Optional(CONF_COMMAND_OPEN, default="true"): cv.template,
         vol.Optional(CONF_COMMAND_STATE, default=None): vol.Any(cv.template, None),
         vol.Optional(CONF_COMMAND_STOP, default="true"): cv.template,
+        vol.Optional(CONF_COMMAND_SET_POSITION): cv.template,
         vol.Optional(CONF_FRIENDLY_NAME): cv.string,
         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
         vol.Optional(CONF_POLLING, default=True): cv.boolean,
+        vol.Optional(CONF_ADAPTIVE_POLLING): ADAPTIVE_POLLING_SCHEMA,
+        vol.Optional(CONF_BURST_INTERVAL, default=DEFAULT_BURST_INTERVAL): cv.time_period,
+        vol.Optional(CONF_BURST_DURATION, default=DEFAULT_BURST_DURATION): cv.time_period,
+        vol.Optional(CONF_STARTUP_REFRESH, default=STARTUP_DEFERRED): STARTUP_REFRESH_SCHEMA,
     }
 )
 
@@ -39,10 +73,15 @@ PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up cover controlled by shell commands."""
+    if discovery_info is not None:
+        await async_setup_host_entities(
+            hass, discovery_info, PLATFORM_SCHEMA, async_setup_platform, async_add_entities
+        )
+        return
 
-    setup_reload_service(hass, DOMAIN, PLATFORMS)
+    await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
 
     devices = config.get(CONF_COVERS, {})
     covers = []
@@ -51,6 +90,8 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         value_template = device_config.get(CONF_VALUE_TEMPLATE)
         if value_template is not None:
             value_template.hass = hass
+        # The entities of a host are polled by its coordinator
+        polling = device_config[CONF_POLLING] and config.get(CONF_POLLING, True)
 
         covers.append(
             CommandCover(
@@ -62,6 +103,12 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
                 device_config[CONF_COMMAND_STOP],
                 device_config.get(CONF_COMMAND_STATE),
                 value_template,
+                device_config.get(CONF_ADAPTIVE_POLLING) if polling else None,
+                device_config.get(CONF_COMMAND_SET_POSITION),
+                device_config[CONF_BURST_INTERVAL],
+                device_config[CONF_BURST_DURATION],
+                device_config[CONF_STARTUP_REFRESH],
+                polling,
             )
         )
 
@@ -69,11 +116,14 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         _LOGGER.error("No covers added")
         return False
 
-    add_entities(covers)
+    async_add_entities(covers)
 
 
-class CommandCover(CoverEntity):
-    """Representation a command line cover."""
+class CommandCover(CoverEntity, RestoreEntity):
+    """Representation a command line cover.
+
+    Unless updated right away, the cover starts with its last known position.
+    """
 
     def __init__(
         self,
@@ -85,35 +135,105 @@ class CommandCover(CoverEntity):
         command_stop,
         command_state,
         value_template,
+        adaptive_polling=None,
+        command_set_position=None,
+        burst_interval=None,
+        burst_duration=DEFAULT_BURST_DURATION,
+        startup_refresh=STARTUP_IMMEDIATE,
+        polling=True,
     ):
         """Initialize the cover."""
         self._hass = hass
         self._name = name
         self._state = None
-        self._command_open = CommandData(hass, config, command_open)
-        self._command_close = CommandData(hass, config, command_close)
-        self._command_stop = CommandData(hass, config, command_stop)
+        self._command_open = CommandData(
+            hass, config, command_open, action=True, name=f"{name} (open)"
+        )
+        self._command_close = CommandData(
+            hass, config, command_close, action=True, name=f"{name} (close)"
+        )
+        self._command_stop = CommandData(
+            hass, config, command_stop, action=True, name=f"{name} (stop)"
+        )
+        self._command_set_position = None
+        self._attr_supported_features = (
+            CoverEntityFeature.OPEN | CoverEntityFeature.CLOSE | CoverEntityFeature.STOP
+        )
+        if command_set_position:
+            self._command_set_position = CommandData(
+                hass, config, command_set_position, action=True, name=f"{name} (position)"
+            )
+            self._attr_supported_features |= CoverEntityFeature.SET_POSITION
         if command_state:
-            self._command_state = CommandData(hass, config, command_state)
+            self._command_state = CommandData(
+                hass, config, command_state, name=name
+            )
         else:
             self._command_state = None
         self._value_template = value_template
-        self._polling = config.get(CONF_POLLING)
+        self._polling = polling
+        self._startup_refresh = None
+        if self._command_state and self._polling:
+            self._startup_refresh = startup_refresh
+        self._adaptive = None
+        if self._command_state and adaptive_polling:
+            self._adaptive = AdaptivePolling(self._command_state, adaptive_polling)
+        self._burst = None
+        # The state of the covers of a host is polled with the other commands
+        if self._command_state and burst_interval and not config.get(CONF_HOST_GROUP):
+            self._burst = BurstPolling(self._command_state, burst_interval, burst_duration)
 
-    @classmethod
-    def _move_cover(cls, command):
-        """Execute the actual commands."""
-        success = command.update(False) == 0
+    async def _async_move_cover(self, command, variables=None):
+        """Execute the actual commands, then follow the state of the cover."""
+        success = await command.async_update(False, variables=variables) == 0
 
         if not success:
             _LOGGER.error("Command failed: %s", command)
+        if self._burst:
+            self._burst.async_start(self)
 
         return success
 
     @property
     def should_poll(self):
         """Only poll if we have state command."""
-        return (self._polling and self._command_state is not None)
+        return (self._polling and self._command_state is not None and self._adaptive is None)
+
+    async def async_added_to_hass(self):
+        """Restore the last state, then start the adaptive polling."""
+        self._command_open.stats_name = f"{self.entity_id} (open)"
+        self._command_close.stats_name = f"{self.entity_id} (close)"
+        self._command_stop.stats_name = f"{self.entity_id} (stop)"
+        if self._command_set_position:
+            self._command_set_position.stats_name = f"{self.entity_id} (position)"
+        if self._command_state:
+            self._command_state.stats_name = self.entity_id
+        if self._startup_refresh == STARTUP_IMMEDIATE:
+            self.async_schedule_update_ha_state(True)
+        else:
+            last_state = await self.async_get_last_state()
+            if last_state is not None:
+                self._state = last_state.attributes.get(ATTR_CURRENT_POSITION)
+        if self._startup_refresh == STARTUP_DEFERRED:
+            self.async_on_remove(
+                async_defer_update(self.hass, partial(self.async_update_ha_state, True))
+            )
+        if self._adaptive:
+            self._adaptive.async_start(self)
+
+    async def async_will_remove_from_hass(self):
+        """Stop the adaptive and burst polling."""
+        if self._command_state:
+            self._command_state.async_release()
+        if self._adaptive:
+            self._adaptive.async_stop()
+        if self._burst:
+            self._burst.async_stop()
+
+    @property
+    def available(self):
+        """Return False while the host of the commands is unreachable."""
+        return (self._command_state or self._command_open).available
 
     @property
     def name(self):
@@ -134,22 +254,30 @@ class CommandCover(CoverEntity):
         """
         return self._state
 
-    def update(self):
+    async def async_update(self):
         """Update device state."""
         if self._command_state:
-            payload = str(self._command_state.update(with_value=True))
+            payload = str(await self._command_state.async_update(with_value=True))
             if self._value_template:
-                payload = self._value_template.render_with_possible_json_value(payload)
+                payload = self._value_template.async_render_with_possible_json_value(
+                    payload
+                )
             self._state = int(payload)
 
-    def open_cover(self, **kwargs):
+    async def async_open_cover(self, **kwargs):
         """Open the cover."""
-        self._move_cover(self._command_open)
+        await self._async_move_cover(self._command_open)
 
-    def close_cover(self, **kwargs):
+    async def async_close_cover(self, **kwargs):
         """Close the cover."""
-        self._move_cover(self._command_close)
+        await self._async_move_cover(self._command_close)
 
-    def stop_cover(self, **kwargs):
+    async def async_stop_cover(self, **kwargs):
         """Stop the cover."""
-        self._move_cover(self._command_stop)
+        await self._async_move_cover(self._command_stop)
+
+    async def async_set_cover_position(self, **kwargs):
+        """Move the cover to a position."""
+        await self._async_move_cover(
+            self._command_set_position, {"position": kwargs[ATTR_POSITION]}
+        )
@@ -0,0 +1,95 @@
+"""Base of the sensors and binary sensors taking their state from a command."""
+from __future__ import annotations
+
+from functools import partial
+
+from homeassistant.helpers.restore_state import RestoreEntity
+
+from .agent import async_add_agent_command
+from .const import MODE_AGENT, MODE_POLL, MODE_STREAM, STARTUP_DEFERRED, STARTUP_IMMEDIATE
+from .startup import async_defer_update
+from .stream import CommandStream
+
+
+class CommandEntity(RestoreEntity):
+    """Representation of an entity taking its state from the output of a command.
+
+    Depending on its mode, the command is polled, kept running or run by the
+    agent of its host. With a coordinator, the entity takes its state from the
+    output of the command run by the coordinator, instead of running it. Unless
+    updated before being added, the entity starts with its last known state.
+    """
+
+    def __init__(
+        self,
+        data,
+        polling,
+        mode=MODE_POLL,
+        adaptive=None,
+        scan_interval=None,
+        startup_refresh=STARTUP_IMMEDIATE,
+        coordinator=None,
+    ):
+        """Initialize the entity fed by data."""
+        self.data = data
+        self._coordinator = coordinator
+        self._polling = polling
+        self._attr_should_poll = polling and adaptive is None
+        self._startup_refresh = startup_refresh
+        self._mode = mode
+        self._stream = None
+        self._scan_interval = scan_interval
+        self._remove_agent_command = None
+        self._adaptive = adaptive
+
+    async def async_added_to_hass(self):
+        """Restore the last state, then start the stream command."""
+        # The first of the entities sharing a command names it
+        if self.data.stats_name is None:
+            self.data.stats_name = self.entity_id
+        if not self._polling or self._startup_refresh != STARTUP_IMMEDIATE:
+            await self._async_restore()
+        if self._coordinator and self._coordinator.data is not None:
+            self._process_value(*self._coordinator.data)
+        if self._polling and self._startup_refresh == STARTUP_DEFERRED:
+            self.async_on_remove(
+                async_defer_update(self.hass, partial(self.async_update_ha_state, True))
+            )
+        if self._mode == MODE_STREAM:
+            self._stream = CommandStream(self.hass, self.data, self._async_handle_line)
+            self._stream.async_start()
+        elif self._mode == MODE_AGENT:
+            self._remove_agent_command = await async_add_agent_command(
+                self.hass, self.data, self._scan_interval, self._async_handle_line
+            )
+        if self._adaptive:
+            self._adaptive.async_start(self)
+
+    async def async_will_remove_from_hass(self):
+        """Stop the stream command."""
+        self.data.async_release()
+        if self._adaptive:
+            self._adaptive.async_stop()
+        if self._remove_agent_command:
+            self._remove_agent_command()
+            self._remove_agent_command = None
+        if self._stream:
+            await self._stream.async_stop()
+            self._stream = None
+
+    @property
+    def available(self):
+        """Return False while the host of the command is unreachable."""
+        return self.data.available
+
+    async def _async_restore(self):
+        """Restore the last known state."""
+        raise NotImplementedError
+
+    def _async_handle_line(self, line):
+        """Update the state from a line of the stream command."""
+        raise NotImplementedError
+
+    def _process_value(self, value, json_value=None):
+        """Update the state from a command output, decoded beforehand if json_value."""
+        raise NotImplementedError
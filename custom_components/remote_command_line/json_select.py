@@ -0,0 +1,93 @@
+"""Select values in decoded JSON documents with path selectors.
+
+A selector is a dotted path of keys with optional list indices, e.g.
+"State.Health.Status" or "blockdevices[0].children[1].size". Keys holding dots
+or brackets can be quoted: 'labels["com.docker.compose.service"]'.
+"""
+from __future__ import annotations
+
+import json
+import re
+
+import voluptuous as vol
+
+_TOKEN = re.compile(
+    r"""\.?(?:(?P<key>[^.\[\]"']+)|\[(?P<index>-?\d+)\]|\[(?P<quote>["'])(?P<quoted>.*?)(?P=quote)\])"""
+)
+
+
+def compile_selector(selector: str) -> tuple[str | int, ...]:
+    """Split a selector into its keys and list indices."""
+    path = []
+    position = 0
+    while position < len(selector):
+        match = _TOKEN.match(selector, position)
+        if match is None or (position == 0 and selector.startswith(".")):
+            raise ValueError(f"Invalid JSON selector: {selector}")
+        if match["index"] is not None:
+            path.append(int(match["index"]))
+        else:
+            path.append(match["key"] if match["key"] is not None else match["quoted"])
+        position = match.end()
+    if not path:
+        raise ValueError("Empty JSON selector")
+    return tuple(path)
+
+
+def json_selector(value):
+    """Validate a JSON selector."""
+    try:
+        compile_selector(value)
+    except (TypeError, ValueError) as ex:
+        raise vol.Invalid(str(ex)) from ex
+    return value
+
+
+def attribute_name(path) -> str:
+    """Return the attribute name of a selector, its last key."""
+    for part in reversed(path):
+        if isinstance(part, str):
+            return part
+    return str(path[-1])
+
+
+def unique_attribute_names(selectors):
+    """Validate that selectors name different attributes."""
+    names = {}
+    for selector in selectors:
+        name = attribute_name(compile_selector(selector))
+        if name in names:
+            raise vol.Invalid(
+                f"JSON selectors {names[name]} and {selector} both name attribute {name}"
+            )
+        names[name] = selector
+    return selectors
+
+
+def select(document, path):
+    """Return the value at path in a document, raising LookupError if missing."""
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(document, list):
+                raise LookupError(part)
+            document = document[part]
+        else:
+            if not isinstance(document, dict):
+                raise LookupError(part)
+            document = document[part]
+    return document
+
+
+def decode(value, max_size=None):
+    """Decode a JSON document, returning None if not JSON or longer than max_size."""
+    if not value or (max_size and len(value) > max_size):
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def to_text(value) -> str:
+    """Return a selected value as text, JSON encoding everything but strings."""
+    return value if isinstance(value, str) else json.dumps(value)
@@ -1,57 +1,91 @@
 """Support for command line notification services."""
+import asyncio
 import logging
-import subprocess
 
 import voluptuous as vol
 
 from homeassistant.components.notify import BaseNotificationService
 from homeassistant.const import CONF_COMMAND, CONF_NAME
 import homeassistant.helpers.config_validation as cv
-from homeassistant.util.process import kill_subprocess
 
+from . import CommandData
 from .const import BASE_SSH_PLATFORM_SCHEMA, CONF_COMMAND_TIMEOUT, DEFAULT_TIMEOUT
 
 _LOGGER = logging.getLogger(__name__)
 
+CONF_BATCH_WINDOW = "batch_window"
+CONF_QUEUE_SIZE = "queue_size"
+
+DEFAULT_QUEUE_SIZE = 100
+
 PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
     {
-        vol.Required(CONF_COMMAND): cv.string,
+        vol.Required(CONF_COMMAND): cv.template,
         vol.Optional(CONF_NAME): cv.string,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
+        vol.Optional(CONF_BATCH_WINDOW, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional(CONF_QUEUE_SIZE, default=DEFAULT_QUEUE_SIZE): cv.positive_int,
     }
 )
 
 
-def get_service(hass, config, discovery_info=None):
+async def async_get_service(hass, config, discovery_info=None):
     """Get the Command Line notification service."""
-    command = config[CONF_COMMAND]
-    timeout = config[CONF_COMMAND_TIMEOUT]
+    data = CommandData(
+        hass,
+        config,
+        config[CONF_COMMAND],
+        action=True,
+        name=f"notify.{config.get(CONF_NAME) or 'notify'}",
+    )
 
-    return CommandLineNotificationService(command, timeout)
+    return CommandLineNotificationService(
+        hass, data, config[CONF_BATCH_WINDOW], config[CONF_QUEUE_SIZE]
+    )
 
 
 class CommandLineNotificationService(BaseNotificationService):
-    """Implement the notification service for the Command Line service."""
+    """Implement the notification service for the Command Line service.
+
+    With a batch window, the messages sent within the window are passed
+    together, one per line, to a single run of the command. At most queue_size
+    messages wait for their run, further senders wait for room in the queue.
+    """
 
-    def __init__(self, command, timeout):
+    def __init__(self, hass, data, batch_window=0, queue_size=DEFAULT_QUEUE_SIZE):
         """Initialize the service."""
-        self.command = command
-        self._timeout = timeout
+        self.hass = hass
+        self.data = data
+        self._batch_window = batch_window
+        self._queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
 
-    def send_message(self, message="", **kwargs):
+    async def async_send_message(self, message="", **kwargs):
         """Send a message to a command line."""
-        with subprocess.Popen(
-            self.command,
-            universal_newlines=True,
-            stdin=subprocess.PIPE,
-            shell=True,  # nosec # shell by design
-        ) as proc:
-            try:
-                proc.communicate(input=message, timeout=self._timeout)
-                if proc.returncode != 0:
-                    _LOGGER.error("Command failed: %s", self.command)
-            except subprocess.TimeoutExpired:
-                _LOGGER.error("Timeout for command: %s", self.command)
-                kill_subprocess(proc)
-            except subprocess.SubprocessError:
-                _LOGGER.error("Error trying to exec command: %s", self.command)
+        if not self._batch_window:
+            await self._async_run(message)
+            return
+
+        if self._worker is None:
+            self._queue = asyncio.Queue(self._queue_size)
+            self._worker = self.hass.async_create_background_task(
+                self._async_run_batches(), f"remote_command_line notify {self.data.name}"
+            )
+        await self._queue.put(message)
+
+    async def _async_run_batches(self):
+        """Run the command for each batch of queued messages."""
+        while True:
+            messages = [await self._queue.get()]
+            await asyncio.sleep(self._batch_window)
+            while not self._queue.empty():
+                messages.append(self._queue.get_nowait())
+            _LOGGER.debug("Sending %d batched notifications", len(messages))
+            await self._async_run("".join(f"{message}\n" for message in messages))
+
+    async def _async_run(self, message):
+        """Run the command with a message as its input."""
+        await self.data.async_update(False, stdin=message.encode("utf-8"))
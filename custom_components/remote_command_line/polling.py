@@ -0,0 +1,131 @@
+"""Poll entities at an interval adapting to how often their value changes."""
+from __future__ import annotations
+
+import logging
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+
+from .const import CONF_MAX_INTERVAL, CONF_MIN_INTERVAL
+
+_LOGGER = logging.getLogger(__name__)
+
+# Consecutive polls with the same output ending a burst
+SETTLE_POLLS = 3
+
+
+class AdaptivePolling:
+    """Update an entity, backing off while its value is stable or failing.
+
+    The interval doubles after each update getting the same output as the
+    previous one, or failing, up to the maximum interval. It goes back to the
+    minimum interval as soon as the output changes.
+    """
+
+    def __init__(self, data, config):
+        """Initialize the polling of the entity fed by data."""
+        self.data = data
+        self.min_interval = config[CONF_MIN_INTERVAL].total_seconds()
+        self.max_interval = config[CONF_MAX_INTERVAL].total_seconds()
+        self.interval = self.min_interval
+        self._entity = None
+        self._cancel = None
+
+    @callback
+    def async_start(self, entity):
+        """Start polling the entity."""
+        self._entity = entity
+        self._schedule()
+
+    @callback
+    def async_stop(self):
+        """Stop polling the entity."""
+        self._entity = None
+        if self._cancel:
+            self._cancel()
+            self._cancel = None
+
+    @callback
+    def _schedule(self):
+        """Schedule the next update."""
+        self._cancel = async_call_later(self.data.hass, self.interval, self._async_poll)
+
+    async def _async_poll(self, _now):
+        """Update the entity and schedule the next update."""
+        self._cancel = None
+        entity = self._entity
+        try:
+            await entity.async_update_ha_state(True)
+        finally:
+            self._adapt()
+            _LOGGER.debug("Next update of %s in %ss", entity.entity_id, self.interval)
+            # The entity may have been removed during the update
+            if self._entity is not None:
+                self._schedule()
+
+    def _adapt(self):
+        """Adapt the interval to the result of the last update."""
+        if self.data.failed or not self.data.changed:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = self.min_interval
+
+
+class BurstPolling:
+    """Update an entity quickly after an action, until its state settles.
+
+    The entity is updated right away, then every interval seconds until its
+    state command got the same output SETTLE_POLLS times in a row, for at most
+    duration seconds. During a burst, the updates of the entity run the command,
+    whatever the result cache holds from before the action.
+    """
+
+    def __init__(self, data, interval, duration):
+        """Initialize the bursts of the entity whose state is fed by data."""
+        self.data = data
+        self.interval = interval.total_seconds()
+        self.duration = duration.total_seconds()
+        self._entity = None
+        self._cancel = None
+        self._until = 0.0
+        self._unchanged = 0
+
+    @callback
+    def async_start(self, entity):
+        """Start a burst of updates of the entity, or restart the current one."""
+        self.async_stop()
+        self._entity = entity
+        self._until = time.monotonic() + self.duration
+        self._unchanged = 0
+        self.data.bypass_cache = True
+        self._schedule(0)
+
+    @callback
+    def async_stop(self):
+        """Stop the current burst."""
+        self._entity = None
+        self.data.bypass_cache = False
+        if self._cancel:
+            self._cancel()
+            self._cancel = None
+
+    @callback
+    def _schedule(self, delay):
+        """Schedule the next update."""
+        self._cancel = async_call_later(self.data.hass, delay, self._async_poll)
+
+    async def _async_poll(self, _now):
+        """Update the entity and schedule the next update, unless settled."""
+        self._cancel = None
+        entity = self._entity
+        await entity.async_update_ha_state(True)
+        self._unchanged = 0 if self.data.changed else self._unchanged + 1
+        if self._entity is not entity:
+            # Stopped or restarted during the update
+            return
+        if self._unchanged >= SETTLE_POLLS or time.monotonic() >= self._until:
+            _LOGGER.debug("State of %s settled", entity.entity_id)
+            self.async_stop()
+            return
+        self._schedule(self.interval)
@@ -0,0 +1,195 @@
+"""Persistent SSH connections shared by the remote_command_line entities."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import shlex
+import stat
+import time
+
+from .breaker import CircuitBreaker
+from .const import BACKEND_ASYNCSSH
+from .process import async_exec, async_stream
+
+_LOGGER = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL = 60
+
+
+class SshConnection:
+    """Run commands on one (user, host, key) with the ssh binary.
+
+    When multiplexing, the commands share an OpenSSH master connection. The
+    commands fail fast while breaker, the circuit of the host, is open.
+    """
+
+    def __init__(
+        self, user, host, key, idle_timeout, multiplex=True, breaker=None, control_dir=None
+    ):
+        """Initialize the connection, its master socket being in control_dir."""
+        self.user = user
+        self.host = host
+        self.key = key
+        self.idle_timeout = idle_timeout
+        self.multiplex = multiplex and control_dir is not None
+        self.breaker = breaker or CircuitBreaker(host)
+        self.control_path = None
+        if self.multiplex:
+            digest = hashlib.sha1(f"{user}@{host}:{key}".encode("utf-8")).hexdigest()
+            # ControlPath is limited to ~100 characters, keep it short
+            self.control_path = os.path.join(control_dir, digest[:16])
+        self._last_check = 0.0
+
+        options = "-4 -o ConnectTimeout=3 -o StrictHostKeyChecking=no"
+        if self.multiplex:
+            options += f" {self.options}"
+        if key:
+            options += f" -i {shlex.quote(key)}"
+        self.prefix = f"ssh {options} {shlex.quote(self.destination)}"
+
+    @property
+    def destination(self):
+        """Return the ssh destination."""
+        return f"{self.user}@{self.host}" if self.user else self.host
+
+    @property
+    def options(self):
+        """Return the ssh options attaching a command to the master connection."""
+        return (
+            f"-o ControlMaster=auto -o ControlPath={self.control_path}"
+            f" -o ControlPersist={self.idle_timeout}"
+        )
+
+    def command_line(self, command):
+        """Return the local shell command running command on the host."""
+        return f"{self.prefix} {shlex.quote(command)}"
+
+    async def _async_control(self, operation):
+        """Send a control command to the master connection."""
+        proc = await asyncio.create_subprocess_exec(
+            "ssh",
+            "-O",
+            operation,
+            "-o",
+            f"ControlPath={self.control_path}",
+            self.destination,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            return await asyncio.wait_for(proc.wait(), 5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return -1
+
+    async def async_check(self):
+        """Verify the master connection, dropping it if it went stale."""
+        now = time.monotonic()
+        if not self.multiplex or now - self._last_check < HEALTH_CHECK_INTERVAL:
+            return
+        self._last_check = now
+
+        if not os.path.exists(self.control_path):
+            return
+        try:
+            alive = await self._async_control("check") == 0
+        except OSError:
+            alive = False
+        if not alive:
+            _LOGGER.debug("Removing stale SSH master for %s", self.destination)
+            try:
+                os.unlink(self.control_path)
+            except OSError:
+                pass
+
+    async def async_exec(self, command, timeout, stdin=None, capture=None, stderr=None):
+        """Run a command on the host and return (returncode, stdout)."""
+        await self.async_check()
+        return await self.breaker.async_call(
+            async_exec, self.command_line(command), timeout, stdin, capture, stderr
+        )
+
+    async def async_stream(self, command, line_callback):
+        """Run a command on the host, passing each output line to line_callback."""
+        await self.async_check()
+        return await self.breaker.async_call(
+            async_stream, self.command_line(command), line_callback
+        )
+
+    async def async_close(self):
+        """Terminate the master connection."""
+        if not self.multiplex or not os.path.exists(self.control_path):
+            return
+        try:
+            await self._async_control("exit")
+        except OSError:
+            _LOGGER.debug("Unable to close SSH master for %s", self.destination)
+
+
+class SshConnectionPool:
+    """Keep one SSH connection per (user, host, key), and one circuit per host."""
+
+    def __init__(self, control_dir):
+        """Initialize the pool, the master sockets being in control_dir."""
+        self._connections: dict[tuple, SshConnection] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._control_dir = control_dir
+        self._control_dir_private: bool | None = None
+
+    def _check_control_dir(self):
+        """Create the directory of the master sockets, returning whether it is private.
+
+        Anyone able to write in it could take over the master connections, so
+        a directory that is not a directory of ours, closed to the others, is
+        not used.
+        """
+        if self._control_dir_private is None:
+            try:
+                os.makedirs(self._control_dir, mode=0o700, exist_ok=True)
+                info = os.lstat(self._control_dir)
+            except OSError as ex:
+                _LOGGER.warning("Unable to create %s: %s", self._control_dir, ex)
+                self._control_dir_private = False
+                return False
+            self._control_dir_private = (
+                stat.S_ISDIR(info.st_mode)
+                and info.st_uid == os.getuid()
+                and not info.st_mode & 0o077
+            )
+            if not self._control_dir_private:
+                _LOGGER.warning(
+                    "%s is not a private directory, not multiplexing SSH connections",
+                    self._control_dir,
+                )
+        return self._control_dir_private
+
+    def get(self, user, host, key, idle_timeout, multiplex, backend):
+        """Return the connection for a target, creating it if needed."""
+        target = (user, host, key, multiplex, backend)
+        if target not in self._connections:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(host)
+            breaker = self._breakers[host]
+            if backend == BACKEND_ASYNCSSH:
+                # Imported here so that asyncssh is only loaded when used
+                from .ssh_client import AsyncSshConnection
+
+                connection = AsyncSshConnection(user, host, key, idle_timeout, breaker)
+            else:
+                control_dir = None
+                if multiplex and self._check_control_dir():
+                    control_dir = self._control_dir
+                connection = SshConnection(
+                    user, host, key, idle_timeout, multiplex, breaker, control_dir
+                )
+            self._connections[target] = connection
+        return self._connections[target]
+
+    async def async_close(self):
+        """Terminate all the connections."""
+        connections = list(self._connections.values())
+        self._connections.clear()
+        await asyncio.gather(*(connection.async_close() for connection in connections))
@@ -0,0 +1,219 @@
+"""Run shell commands as local processes."""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import os
+import signal
+
+from .const import OUTPUT_HEAD, OUTPUT_TAIL
+
+_LOGGER = logging.getLogger(__name__)
+
+LINE_LIMIT = 1024 * 1024
+READ_SIZE = 64 * 1024
+STDERR_LIMIT = 4096
+STDERR_GRACE = 0.1
+
+
+async def _async_kill(proc):
+    """Kill the process group of a process and wait for it."""
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        # The process only completes once its pipes are read to their end
+        for reader in (proc.stdout, proc.stderr):
+            if reader is not None:
+                while await reader.read(READ_SIZE):
+                    pass
+        await proc.wait()
+
+
+@dataclass
+class CommandResult:
+    """The outcome of a run of a command.
+
+    returncode is None when the command did not complete, error then tells why.
+    """
+
+    command: str | None = None
+    returncode: int | None = None
+    stdout: bytes = b""
+    stderr: bytes = b""
+    duration: float = 0.0
+    timed_out: bool = False
+    error: str | None = None
+
+    @property
+    def output(self):
+        """Return the standard output as text."""
+        return self.stdout.strip().decode("utf-8", "replace")
+
+    def as_dict(self):
+        """Return the result as service response data."""
+        return {
+            "exit_code": self.returncode,
+            "stdout": self.output,
+            "stderr": self.stderr.strip().decode("utf-8", "replace"),
+            "duration": round(self.duration, 3),
+            "error": self.error,
+        }
+
+
+class OutputCapture:
+    """Collect the output of a command, keeping at most limit bytes of it.
+
+    With keep "head" the capture is complete once limit bytes were read, with
+    keep "tail" the last limit bytes read are kept. callback is passed each
+    chunk of output as it is read.
+    """
+
+    def __init__(self, limit=None, keep=OUTPUT_HEAD, callback=None):
+        """Initialize the capture."""
+        self.limit = limit
+        self.keep = keep
+        self.callback = callback
+        self.truncated = False
+        self._buffer = bytearray()
+
+    @property
+    def complete(self):
+        """Return whether no more output is wanted."""
+        return self.truncated and self.keep == OUTPUT_HEAD
+
+    def feed(self, chunk):
+        """Add a chunk of output."""
+        if self.callback is not None:
+            self.callback(chunk)
+        self._buffer += chunk
+        if self.limit is None or len(self._buffer) <= self.limit:
+            return
+        self.truncated = True
+        if self.keep == OUTPUT_HEAD:
+            del self._buffer[self.limit :]
+        elif len(self._buffer) > 2 * self.limit:
+            # Trimmed once it doubled, to keep the appends amortized
+            del self._buffer[: -self.limit]
+
+    def getvalue(self):
+        """Return the captured output."""
+        if self.keep == OUTPUT_TAIL and self.limit is not None:
+            del self._buffer[: -self.limit]
+        return bytes(self._buffer)
+
+
+async def async_read_output(reader, capture):
+    """Read a stream into a capture until its end or until the capture is complete."""
+    while not capture.complete:
+        chunk = await reader.read(READ_SIZE)
+        if not chunk:
+            break
+        capture.feed(chunk)
+
+
+async def _async_write_input(writer, stdin):
+    """Write the input of a command and close it."""
+    try:
+        writer.write(stdin)
+        await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    writer.write_eof()
+
+
+async def async_communicate(proc, stdin, capture, async_kill=_async_kill, stderr=None):
+    """Exchange the input and outputs of a process, returning its stderr capture.
+
+    async_kill terminates the process once the capture is complete. stderr, a
+    capture keeping the tail, defaults to the last STDERR_LIMIT bytes.
+    """
+    stderr = stderr or OutputCapture(STDERR_LIMIT, OUTPUT_TAIL)
+    reader = asyncio.ensure_future(async_read_output(proc.stderr, stderr))
+    tasks = [reader]
+    if stdin is not None:
+        tasks.append(asyncio.ensure_future(_async_write_input(proc.stdin, stdin)))
+    try:
+        await async_read_output(proc.stdout, capture)
+        if capture.complete:
+            await async_kill(proc)
+        await asyncio.gather(*tasks[1:])
+        await proc.wait()
+        # A process left in the background may hold the error output open, it
+        # is only read for as long as what the command wrote takes to arrive
+        await asyncio.wait([reader], timeout=STDERR_GRACE)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return stderr
+
+
+def command_result(command, returncode, capture, stderr):
+    """Return the (returncode, stdout) of a command, logging its diagnostics."""
+    if capture.truncated:
+        _LOGGER.warning(
+            "Output of %s exceeded %s bytes, keeping its %s", command, capture.limit, capture.keep
+        )
+        if capture.complete:
+            # Terminated once the head was read, not a failure of the command
+            returncode = 0
+    if returncode != 0 and stderr.getvalue():
+        _LOGGER.debug(
+            "Command %s exited with %s: %s",
+            command,
+            returncode,
+            stderr.getvalue().decode("utf-8", "replace").strip(),
+        )
+    return returncode, capture.getvalue()
+
+
+async def async_exec(command, timeout, stdin=None, capture=None, stderr=None):
+    """Run a shell command asynchronously and return (returncode, stdout).
+
+    The whole process group is killed if the command does not complete within
+    timeout seconds, in which case asyncio.TimeoutError is raised. The output is
+    collected into capture, an unlimited OutputCapture by default, and the
+    command is terminated once a capture keeping the head is complete. The
+    error output is collected into stderr if given.
+    """
+    capture = capture or OutputCapture()
+    proc = await asyncio.create_subprocess_shell(
+        command,  # nosec # shell by design
+        stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stderr = await asyncio.wait_for(
+            async_communicate(proc, stdin, capture, stderr=stderr), timeout
+        )
+    except BaseException:
+        await _async_kill(proc)
+        raise
+    if not proc.stderr.at_eof():
+        # Still held open by a process the command left in the background
+        proc._transport.get_pipe_transport(2).close()  # pylint: disable=protected-access
+    return command_result(command, proc.returncode, capture, stderr)
+
+
+async def async_stream(command, line_callback):
+    """Run a shell command, passing each output line to line_callback.
+
+    Return the exit code of the command once it exits.
+    """
+    proc = await asyncio.create_subprocess_shell(
+        command,  # nosec # shell by design
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        limit=LINE_LIMIT,
+    )
+    try:
+        while line := await proc.stdout.readline():
+            line_callback(line.strip().decode("utf-8", "replace"))
+        return await proc.wait()
+    finally:
+        await _async_kill(proc)
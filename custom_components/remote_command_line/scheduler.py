@@ -0,0 +1,99 @@
+"""Bound and order the commands running at the same time."""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import random
+
+PRIORITY_ACTION = 0
+PRIORITY_POLL = 1
+
+
+class CommandScheduler:
+    """Limit the concurrent commands per host and overall.
+
+    Commands over the limits are queued and started by priority, so that user
+    actions go ahead of background polls, then in submission order.
+    """
+
+    def __init__(self, max_concurrent, poll_jitter=0):
+        """Initialize the scheduler."""
+        self._max_concurrent = max_concurrent
+        self._poll_jitter = poll_jitter
+        self._running = 0
+        self._host_running: dict[str | None, int] = {}
+        self._host_limits: dict[str | None, int] = {}
+        # (priority, order, host, future, whether a session is waiting)
+        self._queue: list[tuple[int, int, str | None, asyncio.Future, bool]] = []
+        self._counter = itertools.count()
+
+    async def async_run(self, host, limit, priority, func, *args):
+        """Await func once a slot is available for host.
+
+        limit is the maximum number of concurrent commands on host, None for no
+        per-host limit.
+        """
+        if priority == PRIORITY_POLL and self._poll_jitter:
+            await asyncio.sleep(random.uniform(0, self._poll_jitter))
+        self._host_limits[host] = limit
+        await self._async_acquire(host, priority)
+        try:
+            return await func(*args)
+        finally:
+            self._release(host)
+
+    async def async_run_session(self, host, limit, func, *args):
+        """Await func, a long-running command holding a slot of host.
+
+        The session is not counted against the overall limit, and only starts
+        while it leaves a slot of host to the other commands, if limit allows.
+        """
+        self._host_limits[host] = limit
+        await self._async_acquire(host, PRIORITY_POLL, session=True)
+        try:
+            return await func(*args)
+        finally:
+            self._release(host, session=True)
+
+    async def _async_acquire(self, host, priority, session=False):
+        """Wait for a slot."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), host, future, session))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation
+                self._release(host, session)
+            raise
+
+    def _release(self, host, session=False):
+        """Free a slot and hand it over to the queued commands."""
+        if not session:
+            self._running -= 1
+        self._host_running[host] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start the queued commands allowed by the limits."""
+        waiting = []
+        while self._queue and self._running < self._max_concurrent:
+            item = heapq.heappop(self._queue)
+            _, _, host, future, session = item
+            if future.done():
+                continue
+            limit = self._host_limits.get(host)
+            if session and limit is not None and limit > 1:
+                # Leave a slot to the commands
+                limit -= 1
+            if limit is not None and self._host_running.get(host, 0) >= limit:
+                waiting.append(item)
+                continue
+            if not session:
+                self._running += 1
+            self._host_running[host] = self._host_running.get(host, 0) + 1
+            future.set_result(None)
+        for item in waiting:
+            heapq.heappush(self._queue, item)
@@ -1,50 +1,130 @@
 """Allows to configure custom shell commands to turn a value for a sensor."""
 from collections.abc import Mapping
 from datetime import timedelta
+from functools import partial
 import json
 import logging
 
 import voluptuous as vol
 
-from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor import (
+    RestoreSensor,
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
 from homeassistant.const import (
     CONF_COMMAND,
     CONF_NAME,
+    CONF_SCAN_INTERVAL,
+    CONF_SENSORS,
     CONF_UNIT_OF_MEASUREMENT,
     CONF_VALUE_TEMPLATE,
     STATE_UNKNOWN,
+    EntityCategory,
+    UnitOfTime,
 )
+from homeassistant.core import callback
+from homeassistant.exceptions import TemplateError
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.reload import setup_reload_service
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.reload import async_setup_reload_service
 
-from . import CommandData
-from .const import BASE_SSH_PLATFORM_SCHEMA, CONF_COMMAND_TIMEOUT, CONF_POLLING, DEFAULT_TIMEOUT, DOMAIN, PLATFORMS
+from . import CommandData, get_stats
+from .const import (
+    ADAPTIVE_POLLING_SCHEMA,
+    BASE_SSH_PLATFORM_SCHEMA,
+    CONF_ADAPTIVE_POLLING,
+    CONF_COMMAND_TIMEOUT,
+    CONF_HOST_GROUP,
+    CONF_MODE,
+    CONF_POLLING,
+    CONF_STARTUP_REFRESH,
+    CONF_VALUE_JSON_PATH,
+    DATA_STATS_LISTENER,
+    DEFAULT_TIMEOUT,
+    DOMAIN,
+    MODE_AGENT,
+    MODE_POLL,
+    MODE_STREAM,
+    PLATFORMS,
+    SIGNAL_STATS_HOST,
+    STARTUP_DEFERRED,
+    STARTUP_IMMEDIATE,
+    STARTUP_REFRESH_SCHEMA,
+)
+from .coordinator import async_setup_host_entities, async_setup_shared_entities
+from .entity import CommandEntity
+from .json_select import (
+    attribute_name,
+    compile_selector,
+    json_selector,
+    select,
+    to_text,
+    unique_attribute_names,
+)
+from .polling import AdaptivePolling
 
 _LOGGER = logging.getLogger(__name__)
 
 CONF_JSON_ATTRIBUTES = "json_attributes"
+CONF_JSON_ATTRIBUTES_PATH = "json_attributes_path"
+CONF_JSON_MAX_SIZE = "json_max_size"
+CONF_DEADBAND = "deadband"
 
 DEFAULT_NAME = "Command Sensor"
 
 SCAN_INTERVAL = timedelta(seconds=60)
 
+# Sensor taking its value from the output of the command of the platform
+SHARED_SENSOR_SCHEMA = vol.Schema(
+    {
+        vol.Required(CONF_NAME): cv.string,
+        vol.Optional(CONF_UNIT_OF_MEASUREMENT): cv.string,
+        vol.Exclusive(CONF_VALUE_TEMPLATE, "value"): cv.template,
+        vol.Exclusive(CONF_VALUE_JSON_PATH, "value"): json_selector,
+        vol.Optional(CONF_JSON_ATTRIBUTES): vol.All(
+            cv.ensure_list_csv, [json_selector], unique_attribute_names
+        ),
+        vol.Optional(CONF_JSON_ATTRIBUTES_PATH): json_selector,
+        vol.Optional(CONF_DEADBAND): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }
+)
+
 PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_COMMAND): cv.template,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
-        vol.Optional(CONF_JSON_ATTRIBUTES): cv.ensure_list_csv,
+        vol.Optional(CONF_JSON_ATTRIBUTES): vol.All(
+            cv.ensure_list_csv, [json_selector], unique_attribute_names
+        ),
+        vol.Optional(CONF_JSON_ATTRIBUTES_PATH): json_selector,
+        vol.Optional(CONF_JSON_MAX_SIZE): cv.positive_int,
+        vol.Optional(CONF_DEADBAND): vol.All(vol.Coerce(float), vol.Range(min=0)),
         vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
         vol.Optional(CONF_UNIT_OF_MEASUREMENT): cv.string,
         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
         vol.Optional(CONF_POLLING, default=True): cv.boolean,
+        vol.Optional(CONF_MODE, default=MODE_POLL): vol.In([MODE_POLL, MODE_STREAM, MODE_AGENT]),
+        vol.Optional(CONF_ADAPTIVE_POLLING): ADAPTIVE_POLLING_SCHEMA,
+        vol.Optional(CONF_STARTUP_REFRESH, default=STARTUP_DEFERRED): STARTUP_REFRESH_SCHEMA,
+        vol.Optional(CONF_SENSORS): vol.All(cv.ensure_list, [SHARED_SENSOR_SCHEMA]),
     }
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Command Sensor."""
+    if discovery_info is not None:
+        if CONF_HOST_GROUP in discovery_info:
+            await async_setup_host_entities(
+                hass, discovery_info, PLATFORM_SCHEMA, async_setup_platform, async_add_entities
+            )
+        else:
+            _async_setup_stats_sensors(hass, async_add_entities)
+        return
 
-    setup_reload_service(hass, DOMAIN, PLATFORMS)
+    await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
 
     name = config.get(CONF_NAME)
     command = config.get(CONF_COMMAND)
@@ -53,61 +133,283 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     if value_template is not None:
         value_template.hass = hass
     json_attributes = config.get(CONF_JSON_ATTRIBUTES)
-    polling = config.get(CONF_POLLING)
+    json_attributes_path = config.get(CONF_JSON_ATTRIBUTES_PATH)
+    json_max_size = config.get(CONF_JSON_MAX_SIZE)
+    deadband = config.get(CONF_DEADBAND)
+    mode = config.get(CONF_MODE)
+    polling = config.get(CONF_POLLING) and mode == MODE_POLL
+    startup_refresh = config.get(CONF_STARTUP_REFRESH, STARTUP_DEFERRED)
     data = CommandData(hass, config, command)
+    adaptive = None
+    if polling and CONF_ADAPTIVE_POLLING in config:
+        adaptive = AdaptivePolling(data, config[CONF_ADAPTIVE_POLLING])
     _LOGGER.info("polling: " + ("yes" if polling else "no"))
 
-    add_entities(
-        [CommandSensor(hass, data, name, unit, value_template, json_attributes, polling)], polling
+    if CONF_SENSORS in config:
+        await async_setup_shared_entities(
+            hass,
+            config,
+            data,
+            polling,
+            config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL),
+            async_add_entities,
+            partial(_create_shared_sensor, hass, data),
+            json_max_size,
+        )
+        return
+
+    async_add_entities(
+        [
+            CommandSensor(
+                hass,
+                data,
+                name,
+                unit,
+                value_template,
+                json_attributes,
+                polling,
+                mode,
+                json_attributes_path,
+                json_max_size,
+                deadband,
+                adaptive,
+                config.get(CONF_SCAN_INTERVAL, SCAN_INTERVAL),
+                startup_refresh,
+            )
+        ],
+        polling and startup_refresh == STARTUP_IMMEDIATE,
+    )
+
+
+def _create_shared_sensor(hass, data, sensor_config, coordinator):
+    """Return a sensor taking its value from the output of coordinator."""
+    value_template = sensor_config.get(CONF_VALUE_TEMPLATE)
+    if value_template is not None:
+        value_template.hass = hass
+    return CommandSensor(
+        hass,
+        data,
+        sensor_config[CONF_NAME],
+        sensor_config.get(CONF_UNIT_OF_MEASUREMENT),
+        value_template,
+        sensor_config.get(CONF_JSON_ATTRIBUTES),
+        False,
+        json_attributes_path=sensor_config.get(CONF_JSON_ATTRIBUTES_PATH),
+        deadband=sensor_config.get(CONF_DEADBAND),
+        value_json_path=sensor_config.get(CONF_VALUE_JSON_PATH),
+        coordinator=coordinator,
     )
 
 
-class CommandSensor(SensorEntity):
+@callback
+def _async_setup_stats_sensors(hass, async_add_entities):
+    """Add a statistics sensor for each host commands are run on.
+
+    Set up again on reload, replacing the listener of the previous setup.
+    """
+    stats = get_stats(hass)
+
+    @callback
+    def async_add_host(host):
+        async_add_entities([CommandStatsSensor(stats, host)], True)
+
+    for host in stats.hosts:
+        async_add_host(host)
+    if remove_listener := hass.data.pop(DATA_STATS_LISTENER, None):
+        remove_listener()
+    hass.data[DATA_STATS_LISTENER] = async_dispatcher_connect(
+        hass, SIGNAL_STATS_HOST, async_add_host
+    )
+
+
+class CommandStatsSensor(SensorEntity):
+    """Representation of the execution statistics of a host."""
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_native_unit_of_measurement = UnitOfTime.SECONDS
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_suggested_display_precision = 3
+
+    def __init__(self, stats, host):
+        """Initialize the sensor."""
+        self._stats = stats
+        self._host = host
+        self._attr_name = f"Remote command latency {host}"
+        self._attr_unique_id = f"{DOMAIN}_latency_{host}"
+
+    async def async_update(self):
+        """Update the state from the statistics."""
+        stats = self._stats.hosts[self._host]
+        self._attr_native_value = stats.mean_latency
+        self._attr_extra_state_attributes = stats.as_dict()
+
+
+class CommandSensor(CommandEntity, RestoreSensor):
     """Representation of a sensor that is using shell commands."""
 
     def __init__(
-        self, hass, data, name, unit_of_measurement, value_template, json_attributes, polling
+        self,
+        hass,
+        data,
+        name,
+        unit_of_measurement,
+        value_template,
+        json_attributes,
+        polling,
+        mode=MODE_POLL,
+        json_attributes_path=None,
+        json_max_size=None,
+        deadband=None,
+        adaptive=None,
+        scan_interval=SCAN_INTERVAL,
+        startup_refresh=STARTUP_IMMEDIATE,
+        value_json_path=None,
+        coordinator=None,
     ):
         """Initialize the sensor."""
+        super().__init__(
+            data, polling, mode, adaptive, scan_interval, startup_refresh, coordinator
+        )
         self._hass = hass
-        self.data = data
         self._attr_extra_state_attributes = None
-        self._json_attributes = json_attributes
+        self._json_attributes = None
+        if json_attributes:
+            self._json_attributes = [
+                (attribute_name(path), path)
+                for path in map(compile_selector, json_attributes)
+            ]
+        self._json_attributes_path = (
+            compile_selector(json_attributes_path) if json_attributes_path else ()
+        )
+        self._json_max_size = json_max_size
+        self._value_json_path = compile_selector(value_json_path) if value_json_path else None
+        self._deadband = deadband
         self._attr_name = name
         self._attr_native_value = None
         self._attr_native_unit_of_measurement = unit_of_measurement
         self._value_template = value_template
-        self._attr_should_poll = polling
 
-    def update(self):
+    async def _async_restore(self):
+        """Restore the last known value and attributes."""
+        if (last_data := await self.async_get_last_sensor_data()) is not None:
+            self._attr_native_value = last_data.native_value
+        if self._json_attributes and (last_state := await self.async_get_last_state()):
+            self._attr_extra_state_attributes = {
+                name: last_state.attributes[name]
+                for name, _ in self._json_attributes
+                if name in last_state.attributes
+            }
+
+    @callback
+    def _async_handle_line(self, line):
+        """Update the state from a line of the stream command."""
+        self.data.set_value(line)
+        if not self.data.changed:
+            return
+        previous = (self._attr_native_value, self._attr_extra_state_attributes)
+        self._process_value(line)
+        if (self._attr_native_value, self._attr_extra_state_attributes) != previous:
+            self.async_write_ha_state()
+
+    async def async_update(self):
         """Get the latest data and updates the state."""
-        value = self.data.update(with_value=True)
+        if self._coordinator:
+            if self._coordinator.data is None:
+                return self._attr_native_value
+            return self._process_value(*self._coordinator.data)
+        value = await self.data.async_update(with_value=True)
+        if not self.data.changed:
+            return self._attr_native_value
+        return self._process_value(value)
+
+    def _decode_json(self, value):
+        """Decode an output as JSON, once for the attributes and the template.
+
+        Return None if the output is empty, too large or not JSON.
+        """
+        if not value:
+            return None
+        if self._json_max_size and len(value) > self._json_max_size:
+            if self._json_attributes:
+                _LOGGER.warning(
+                    "Output of %d characters exceeds json_max_size, not decoding it",
+                    len(value),
+                )
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            if self._json_attributes:
+                _LOGGER.warning("Unable to parse output as JSON: %s", value)
+            return None
+
+    def _process_value(self, value, json_value=None):
+        """Update the state and attributes from a command output.
+
+        json_value is the output decoded by the coordinator, if any.
+        """
+        if not self._coordinator and (
+            self._json_attributes or self._value_template is not None or self._value_json_path
+        ):
+            json_value = self._decode_json(value)
 
         if self._json_attributes:
             self._attr_extra_state_attributes = {}
-            if value:
-                try:
-                    json_dict = json.loads(value)
-                    if isinstance(json_dict, Mapping):
-                        self._attr_extra_state_attributes = {
-                            k: json_dict[k]
-                            for k in self._json_attributes
-                            if k in json_dict
-                        }
-                    else:
-                        _LOGGER.warning("JSON result was not a dictionary")
-                except ValueError:
-                    _LOGGER.warning("Unable to parse output as JSON: %s", value)
-            else:
+            if not value:
                 _LOGGER.warning("Empty reply found when expecting JSON data")
+            elif json_value is not None:
+                try:
+                    json_dict = select(json_value, self._json_attributes_path)
+                except LookupError:
+                    json_dict = None
+                if isinstance(json_dict, Mapping):
+                    attributes = {}
+                    for name, path in self._json_attributes:
+                        try:
+                            attributes[name] = select(json_dict, path)
+                        except LookupError:
+                            pass
+                    self._attr_extra_state_attributes = attributes
+                else:
+                    _LOGGER.warning("JSON result was not a dictionary")
 
         if value is None:
-            value = STATE_UNKNOWN
+            return self._attr_native_value
+        if self._value_json_path is not None:
+            try:
+                native_value = to_text(select(json_value, self._value_json_path))
+            except LookupError:
+                _LOGGER.warning("No value for %s in the output: %s", self.name, value)
+                native_value = None
         elif self._value_template is not None:
-            self._attr_native_value = self._value_template.render_with_possible_json_value(
-                value, STATE_UNKNOWN
-            )
+            variables = {"value": value}
+            if json_value is not None:
+                variables["value_json"] = json_value
+            try:
+                native_value = self._value_template.async_render(
+                    variables, parse_result=False
+                ).strip()
+            except TemplateError as ex:
+                _LOGGER.error(
+                    "Error parsing value: %s (value: %s, template: %s)",
+                    ex,
+                    value,
+                    self._value_template.template,
+                )
+                native_value = STATE_UNKNOWN
         else:
-            self._attr_native_value = value
+            native_value = value
 
+        if not self._within_deadband(native_value):
+            self._attr_native_value = native_value
         return self._attr_native_value
+
+    def _within_deadband(self, native_value):
+        """Return whether a numeric value is too close to the current one to report."""
+        if not self._deadband:
+            return False
+        try:
+            return abs(float(native_value) - float(self._attr_native_value)) < self._deadband
+        except (TypeError, ValueError):
+            return False
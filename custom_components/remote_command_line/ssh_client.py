@@ -0,0 +1,159 @@
+"""Run commands over an in-process SSH connection with asyncssh."""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import asyncssh
+
+from .breaker import CircuitBreaker
+from .process import OutputCapture, async_communicate, command_result
+
+_LOGGER = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 3
+KEEPALIVE_INTERVAL = 30
+
+
+async def _async_close_process(process):
+    """Close the channel of a process and wait for it."""
+    process.close()
+    await process.wait_closed()
+
+
+class AsyncSshConnection:
+    """Run commands on one (user, host, key), each in a channel of one connection."""
+
+    def __init__(self, user, host, key, idle_timeout, breaker=None):
+        """Initialize the connection."""
+        self.user = user
+        self.host = host
+        self.key = key
+        self.idle_timeout = idle_timeout
+        self.breaker = breaker or CircuitBreaker(host)
+        self._conn: asyncssh.SSHClientConnection | None = None
+        self._lock = asyncio.Lock()
+        self._active = 0
+        self._idle_handle: asyncio.TimerHandle | None = None
+
+    @property
+    def destination(self):
+        """Return the ssh destination."""
+        return f"{self.user}@{self.host}" if self.user else self.host
+
+    async def _async_connect(self):
+        """Return the connection, opening it if needed."""
+        async with self._lock:
+            if self._conn is None:
+                _LOGGER.debug("Opening SSH connection to %s", self.destination)
+                self._conn = await asyncio.wait_for(
+                    asyncssh.connect(
+                        self.host,
+                        username=self.user,
+                        client_keys=[self.key] if self.key else (),
+                        known_hosts=None,
+                        keepalive_interval=KEEPALIVE_INTERVAL,
+                    ),
+                    CONNECT_TIMEOUT,
+                )
+            return self._conn
+
+    def _close_idle(self):
+        """Close the connection once unused for idle_timeout seconds."""
+        self._idle_handle = None
+        if self._active == 0 and self._conn is not None:
+            _LOGGER.debug("Closing idle SSH connection to %s", self.destination)
+            self._conn.close()
+            self._conn = None
+
+    async def _async_open_process(self, command, stdin):
+        """Open a channel running command."""
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        try:
+            conn = await self._async_connect()
+            return await conn.create_process(
+                command,
+                encoding=None,
+                stdin=asyncssh.PIPE if stdin is not None else asyncssh.DEVNULL,
+                stderr=asyncssh.PIPE,
+            )
+        except (asyncssh.Error, asyncssh.KeyImportError, OSError) as ex:
+            self._drop(ex)
+            raise OSError(f"SSH connection to {self.destination} failed: {ex}") from ex
+
+    def _drop(self, ex):
+        """Forget a broken connection."""
+        if self._conn is not None:
+            _LOGGER.debug("Dropping SSH connection to %s: %s", self.destination, ex)
+            self._conn.close()
+            self._conn = None
+
+    def _release(self):
+        """Schedule the idle close of the connection after its last use."""
+        self._active -= 1
+        if self._active == 0 and self._conn is not None:
+            self._idle_handle = asyncio.get_running_loop().call_later(
+                self.idle_timeout, self._close_idle
+            )
+
+    async def async_exec(self, command, timeout, stdin=None, capture=None, stderr=None):
+        """Run a command on the host and return (returncode, stdout)."""
+        return await self.breaker.async_call(
+            self._async_exec, command, timeout, stdin, capture, stderr
+        )
+
+    async def _async_exec(self, command, timeout, stdin, capture, stderr):
+        """Run a command in a channel of the connection."""
+        capture = capture or OutputCapture()
+        self._active += 1
+        try:
+            process = await self._async_open_process(command, stdin)
+            try:
+                stderr = await asyncio.wait_for(
+                    async_communicate(
+                        process, stdin, capture, _async_close_process, stderr
+                    ),
+                    timeout,
+                )
+            except asyncssh.Error as ex:
+                self._drop(ex)
+                raise OSError(f"SSH command failed on {self.destination}: {ex}") from ex
+            finally:
+                process.close()
+            return command_result(command, process.returncode, capture, stderr)
+        finally:
+            self._release()
+
+    async def async_stream(self, command, line_callback):
+        """Run a command on the host, passing each output line to line_callback."""
+        return await self.breaker.async_call(self._async_stream, command, line_callback)
+
+    async def _async_stream(self, command, line_callback):
+        """Run a command in a channel of the connection, streaming its output."""
+        self._active += 1
+        try:
+            process = await self._async_open_process(command, None)
+            try:
+                while line := await process.stdout.readline():
+                    line_callback(line.strip().decode("utf-8", "replace"))
+                await process.wait_closed()
+            except asyncssh.Error as ex:
+                self._drop(ex)
+                raise OSError(f"SSH command failed on {self.destination}: {ex}") from ex
+            finally:
+                process.close()
+            return process.returncode
+        finally:
+            self._release()
+
+    async def async_close(self):
+        """Close the connection."""
+        if self._idle_handle:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self._conn is not None:
+            self._conn.close()
+            await self._conn.wait_closed()
+            self._conn = None
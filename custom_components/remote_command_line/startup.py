@@ -0,0 +1,44 @@
+"""Spread the first updates of the entities after Home Assistant started."""
+from __future__ import annotations
+
+import time
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.start import async_at_started
+
+from .const import DATA_STARTUP_SLOT
+
+# Seconds between two deferred first updates
+STARTUP_SPACING = 0.2
+
+
+@callback
+def async_defer_update(hass, async_update):
+    """Await async_update once Home Assistant started, after the updates deferred before.
+
+    The updates are started STARTUP_SPACING seconds apart. Return the callback
+    cancelling the update.
+    """
+    cancel_update = None
+
+    async def async_run(_now):
+        await async_update()
+
+    @callback
+    def async_started(_hass):
+        nonlocal cancel_update
+        now = time.monotonic()
+        slot = max(now, hass.data.get(DATA_STARTUP_SLOT, 0.0))
+        hass.data[DATA_STARTUP_SLOT] = slot + STARTUP_SPACING
+        cancel_update = async_call_later(hass, slot - now, async_run)
+
+    cancel_started = async_at_started(hass, async_started)
+
+    @callback
+    def async_cancel():
+        cancel_started()
+        if cancel_update:
+            cancel_update()
+
+    return async_cancel
@@ -0,0 +1,174 @@
+"""Execution statistics of the remote commands."""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import time
+
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+
+from .const import SIGNAL_STATS_HOST
+
+LOCAL_HOST = "localhost"
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class ExecutionStats:
+    """Statistics of the commands run for a host or an entity."""
+
+    def __init__(self):
+        """Initialize the statistics."""
+        self.executions = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.failures = 0
+        self.output_bytes = 0
+        self.latency_total = 0.0
+        self.queue_wait_total = 0.0
+        self.last_latency = None
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, latency, queue_wait, returncode=None, output_size=0, timeout=False):
+        """Record one execution.
+
+        returncode is None when the command could not be run or timed out.
+        """
+        self.executions += 1
+        self.latency_total += latency
+        self.queue_wait_total += queue_wait
+        self.last_latency = latency
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.output_bytes += output_size
+        if timeout:
+            self.timeouts += 1
+        elif returncode is None:
+            self.errors += 1
+        elif returncode != 0:
+            self.failures += 1
+
+    @property
+    def mean_latency(self):
+        """Return the mean latency in seconds."""
+        if not self.executions:
+            return None
+        return self.latency_total / self.executions
+
+    def percentile(self, percent):
+        """Return the upper bound of the bucket holding a latency percentile."""
+        if not self.executions:
+            return None
+        rank = self.executions * percent / 100
+        count = 0
+        for bound, bucket in zip(LATENCY_BUCKETS, self.histogram):
+            count += bucket
+            if count >= rank:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+    def as_dict(self):
+        """Return the statistics as a dictionary."""
+        return {
+            "executions": self.executions,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "non_zero_exits": self.failures,
+            "output_bytes": self.output_bytes,
+            "mean_latency": self.mean_latency,
+            "last_latency": self.last_latency,
+            "p50_latency": self.percentile(50),
+            "p95_latency": self.percentile(95),
+            "p99_latency": self.percentile(99),
+            "mean_queue_wait": (
+                self.queue_wait_total / self.executions if self.executions else None
+            ),
+            "latency_histogram": {
+                f"le_{bound}": bucket
+                for bound, bucket in zip(LATENCY_BUCKETS, self.histogram)
+            },
+        }
+
+
+class CommandStats:
+    """Statistics of all the commands, per host and per entity."""
+
+    def __init__(self, hass):
+        """Initialize the statistics."""
+        self.hass = hass
+        self.hosts: dict[str, ExecutionStats] = {}
+        self.entities: dict[str, ExecutionStats] = {}
+
+    def record(self, host, entity, *args, **kwargs):
+        """Record one execution for a host and an entity."""
+        host = host or LOCAL_HOST
+        if host not in self.hosts:
+            self.hosts[host] = ExecutionStats()
+            async_dispatcher_send(self.hass, SIGNAL_STATS_HOST, host)
+        self.hosts[host].record(*args, **kwargs)
+        if entity:
+            self.record_entity(entity, *args, **kwargs)
+
+    def record_entity(self, entity, *args, **kwargs):
+        """Record one execution for an entity only."""
+        self.entities.setdefault(entity, ExecutionStats()).record(*args, **kwargs)
+
+    def recorder(self, host, entity):
+        """Return a recorder measuring one execution."""
+        return ExecutionRecorder(self, host, entity)
+
+    def as_dict(self):
+        """Return the statistics as a dictionary."""
+        return {
+            "hosts": {host: stats.as_dict() for host, stats in self.hosts.items()},
+            "entities": {
+                entity: stats.as_dict() for entity, stats in self.entities.items()
+            },
+        }
+
+
+class ExecutionRecorder:
+    """Measure one execution going through a chain of exec functions.
+
+    latency and queue_wait are those of the last execution.
+    """
+
+    def __init__(self, stats, host, entity):
+        """Initialize the recorder, the queue wait starting now."""
+        self._stats = stats
+        self._host = host
+        self._entity = entity
+        self._requested = time.monotonic()
+        self.latency = 0.0
+        self.queue_wait = 0.0
+
+    def wrap(self, exec_func):
+        """Return exec_func, recording its execution."""
+
+        async def async_exec(command, timeout, stdin=None):
+            started = time.monotonic()
+            self.queue_wait = started - self._requested
+            try:
+                returncode, output = await exec_func(command, timeout, stdin)
+            except asyncio.TimeoutError:
+                self.latency = time.monotonic() - started
+                self._stats.record(
+                    self._host, self._entity, self.latency, self.queue_wait, timeout=True
+                )
+                raise
+            except OSError:
+                self.latency = time.monotonic() - started
+                self._stats.record(self._host, self._entity, self.latency, self.queue_wait)
+                raise
+            self.latency = time.monotonic() - started
+            self._stats.record(
+                self._host,
+                self._entity,
+                self.latency,
+                self.queue_wait,
+                returncode,
+                len(output or b""),
+            )
+            return returncode, output
+
+        return async_exec
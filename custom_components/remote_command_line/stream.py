@@ -0,0 +1,84 @@
+"""Feed entities from the output of long-running commands."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+
+_LOGGER = logging.getLogger(__name__)
+
+MIN_BACKOFF = 1
+MAX_BACKOFF = 300
+# A command running that long is considered healthy again
+STABLE_RUN = 60
+
+
+class CommandStream:
+    """Supervise a long-running command, passing each output line to a callback."""
+
+    def __init__(self, hass, data, line_callback, name=None):
+        """Initialize the stream."""
+        self.hass = hass
+        self.data = data
+        self.name = name or data.command.template
+        self._line_callback = line_callback
+        self._task: asyncio.Task | None = None
+        self._remove_stop_listener = None
+
+    @callback
+    def async_start(self):
+        """Start the command in the background."""
+        self._task = self.hass.async_create_background_task(
+            self._async_supervise(), f"remote_command_line stream {self.name}"
+        )
+        self._remove_stop_listener = self.hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, self._async_handle_stop
+        )
+
+    async def _async_handle_stop(self, event):
+        """Stop the command when Home Assistant stops."""
+        self._remove_stop_listener = None
+        await self.async_stop()
+
+    async def async_stop(self):
+        """Stop the command and its supervision."""
+        if self._remove_stop_listener:
+            self._remove_stop_listener()
+            self._remove_stop_listener = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _async_supervise(self):
+        """Run the command, restarting it with an exponential backoff."""
+        backoff = MIN_BACKOFF
+        while True:
+            started = time.monotonic()
+            try:
+                returncode = await self._async_run()
+                _LOGGER.warning(
+                    "Stream command exited with %s: %s", returncode, self.name
+                )
+            except (OSError, ValueError) as ex:
+                _LOGGER.error("Error in stream command %s: %s", self.name, ex)
+            if time.monotonic() - started > STABLE_RUN:
+                backoff = MIN_BACKOFF
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def _async_run(self):
+        """Run the command once, until it exits."""
+        prepared = await self.data.async_prepare()
+        if prepared is None:
+            return None
+        command, connection = prepared
+
+        _LOGGER.debug("Starting stream command: %s", command)
+        return await self.data.async_stream(command, connection, self._line_callback)
@@ -1,4 +1,5 @@
 """Support for custom shell commands to turn a switch on/off."""
+from functools import partial
 import logging
 
 import voluptuous as vol
@@ -14,12 +15,35 @@ from homeassistant.const import (
     CONF_FRIENDLY_NAME,
     CONF_SWITCHES,
     CONF_VALUE_TEMPLATE,
+    STATE_ON,
 )
 import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.reload import setup_reload_service
+from homeassistant.helpers.reload import async_setup_reload_service
+from homeassistant.helpers.restore_state import RestoreEntity
 
 from . import CommandData
-from .const import BASE_SSH_PLATFORM_SCHEMA, CONF_COMMAND_TIMEOUT, CONF_POLLING, DEFAULT_TIMEOUT, DOMAIN, PLATFORMS
+from .const import (
+    ADAPTIVE_POLLING_SCHEMA,
+    BASE_SSH_PLATFORM_SCHEMA,
+    CONF_ADAPTIVE_POLLING,
+    CONF_BURST_DURATION,
+    CONF_BURST_INTERVAL,
+    CONF_COMMAND_TIMEOUT,
+    CONF_HOST_GROUP,
+    CONF_POLLING,
+    CONF_STARTUP_REFRESH,
+    DEFAULT_BURST_DURATION,
+    DEFAULT_BURST_INTERVAL,
+    DEFAULT_TIMEOUT,
+    DOMAIN,
+    PLATFORMS,
+    STARTUP_DEFERRED,
+    STARTUP_IMMEDIATE,
+    STARTUP_REFRESH_SCHEMA,
+)
+from .coordinator import async_setup_host_entities
+from .polling import AdaptivePolling, BurstPolling
+from .startup import async_defer_update
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -32,6 +56,10 @@ SWITCH_SCHEMA = vol.Schema(
         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
         vol.Optional(CONF_COMMAND_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
         vol.Optional(CONF_POLLING, default=True): cv.boolean,
+        vol.Optional(CONF_ADAPTIVE_POLLING): ADAPTIVE_POLLING_SCHEMA,
+        vol.Optional(CONF_BURST_INTERVAL, default=DEFAULT_BURST_INTERVAL): cv.time_period,
+        vol.Optional(CONF_BURST_DURATION, default=DEFAULT_BURST_DURATION): cv.time_period,
+        vol.Optional(CONF_STARTUP_REFRESH, default=STARTUP_DEFERRED): STARTUP_REFRESH_SCHEMA,
     }
 )
 
@@ -40,10 +68,15 @@ PLATFORM_SCHEMA = BASE_SSH_PLATFORM_SCHEMA.extend(
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Find and return switches controlled by shell commands."""
+    if discovery_info is not None:
+        await async_setup_host_entities(
+            hass, discovery_info, PLATFORM_SCHEMA, async_setup_platform, async_add_entities
+        )
+        return
 
-    setup_reload_service(hass, DOMAIN, PLATFORMS)
+    await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
 
     devices = config.get(CONF_SWITCHES, {})
     switches = []
@@ -53,6 +86,8 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
 
         if value_template is not None:
             value_template.hass = hass
+        # The entities of a host are polled by its coordinator
+        polling = device_config[CONF_POLLING] and config.get(CONF_POLLING, True)
 
         switches.append(
             CommandSwitch(
@@ -64,6 +99,11 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
                 device_config[CONF_COMMAND_OFF],
                 device_config.get(CONF_COMMAND_STATE),
                 value_template,
+                device_config.get(CONF_ADAPTIVE_POLLING) if polling else None,
+                device_config[CONF_BURST_INTERVAL],
+                device_config[CONF_BURST_DURATION],
+                device_config[CONF_STARTUP_REFRESH],
+                polling,
             )
         )
 
@@ -71,11 +111,14 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         _LOGGER.error("No switches added")
         return False
 
-    add_entities(switches)
+    async_add_entities(switches)
 
 
-class CommandSwitch(SwitchEntity):
-    """Representation a switch that can be toggled using shell commands."""
+class CommandSwitch(SwitchEntity, RestoreEntity):
+    """Representation a switch that can be toggled using shell commands.
+
+    Unless updated right away, the switch starts with its last known state.
+    """
 
     def __init__(
         self,
@@ -87,25 +130,46 @@ class CommandSwitch(SwitchEntity):
         command_off,
         command_state,
         value_template,
+        adaptive_polling=None,
+        burst_interval=None,
+        burst_duration=DEFAULT_BURST_DURATION,
+        startup_refresh=STARTUP_IMMEDIATE,
+        polling=True,
     ):
         """Initialize the switch."""
         self._hass = hass
         self.entity_id = ENTITY_ID_FORMAT.format(object_id)
         self._name = friendly_name
         self._state = False
-        self._command_on = CommandData(hass, config, command_on)
-        self._command_off = CommandData(hass, config, command_off)
+        self._command_on = CommandData(
+            hass, config, command_on, action=True, name=f"{friendly_name} (on)"
+        )
+        self._command_off = CommandData(
+            hass, config, command_off, action=True, name=f"{friendly_name} (off)"
+        )
         if command_state:
-            self._command_state = CommandData(hass, config, command_state)
+            self._command_state = CommandData(
+                hass, config, command_state, name=friendly_name
+            )
         else:
             self._command_state = None
         self._value_template = value_template
-        self._polling = config.get(CONF_POLLING)
+        self._polling = polling
+        self._startup_refresh = None
+        if self._command_state and self._polling:
+            self._startup_refresh = startup_refresh
+        self._adaptive = None
+        if self._command_state and adaptive_polling:
+            self._adaptive = AdaptivePolling(self._command_state, adaptive_polling)
+        self._burst = None
+        # The state of the switches of a host is polled with the other commands
+        if self._command_state and burst_interval and not config.get(CONF_HOST_GROUP):
+            self._burst = BurstPolling(self._command_state, burst_interval, burst_duration)
 
     @classmethod
-    def _switch(cls, command):
+    async def _async_switch(cls, command):
         """Execute the actual commands."""
-        success = command.update(False) == 0
+        success = await command.async_update(False) == 0
 
         if not success:
             _LOGGER.error("Command failed: %s", command)
@@ -115,7 +179,40 @@ class CommandSwitch(SwitchEntity):
     @property
     def should_poll(self):
         """Only poll if we have state command."""
-        return (self._polling and self._command_state is not None)
+        return (self._polling and self._command_state is not None and self._adaptive is None)
+
+    async def async_added_to_hass(self):
+        """Restore the last state, then start the adaptive polling."""
+        self._command_on.stats_name = f"{self.entity_id} (on)"
+        self._command_off.stats_name = f"{self.entity_id} (off)"
+        if self._command_state:
+            self._command_state.stats_name = self.entity_id
+        if self._startup_refresh == STARTUP_IMMEDIATE:
+            self.async_schedule_update_ha_state(True)
+        else:
+            last_state = await self.async_get_last_state()
+            if last_state is not None:
+                self._state = last_state.state == STATE_ON
+        if self._startup_refresh == STARTUP_DEFERRED:
+            self.async_on_remove(
+                async_defer_update(self.hass, partial(self.async_update_ha_state, True))
+            )
+        if self._adaptive:
+            self._adaptive.async_start(self)
+
+    async def async_will_remove_from_hass(self):
+        """Stop the adaptive and burst polling."""
+        if self._command_state:
+            self._command_state.async_release()
+        if self._adaptive:
+            self._adaptive.async_stop()
+        if self._burst:
+            self._burst.async_stop()
+
+    @property
+    def available(self):
+        """Return False while the host of the commands is unreachable."""
+        return (self._command_state or self._command_on).available
 
     @property
     def name(self):
@@ -132,28 +229,34 @@ class CommandSwitch(SwitchEntity):
         """Return true if we do optimistic updates."""
         return self._command_state is None
 
-    def _query_state(self):
+    async def _async_query_state(self):
         """Query for state."""
         if self._value_template:
-            return self._command_state.update(with_value=True)
-        return self._command_state.update(with_value=False) == 0
+            return await self._command_state.async_update(with_value=True)
+        return await self._command_state.async_update(with_value=False) == 0
 
-    def update(self):
+    async def async_update(self):
         """Update device state."""
         if self._command_state:
-            payload = str(self._query_state())
+            payload = str(await self._async_query_state())
             if self._value_template:
-                payload = self._value_template.render_with_possible_json_value(payload)
+                payload = self._value_template.async_render_with_possible_json_value(
+                    payload
+                )
             self._state = payload.lower() == "true"
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Turn the device on."""
-        if self._switch(self._command_on) and not self._command_state:
+        if await self._async_switch(self._command_on) and not self._command_state:
             self._state = True
-            self.schedule_update_ha_state()
+            self.async_write_ha_state()
+        if self._burst:
+            self._burst.async_start(self)
 
-    def turn_off(self, **kwargs):
+    async def async_turn_off(self, **kwargs):
         """Turn the device off."""
-        if self._switch(self._command_off) and not self._command_state:
+        if await self._async_switch(self._command_off) and not self._command_state:
             self._state = False
-            self.schedule_update_ha_state()
+            self.async_write_ha_state()
+        if self._burst:
+            self._burst.async_start(self)